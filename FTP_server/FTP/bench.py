@@ -0,0 +1,312 @@
+"""Benchmarks for ftp_server.py over loopback.
+
+    python bench.py get --sizes 1M,16M,256M,4G
+
+runs the server against a temporary --dir once per GET mode and reports
+the MB/s a single client sees for each file size.
+
+    python bench.py load --clients 50 --duration 10 --engine threads,asyncio --json
+
+runs the server once per engine and drives it with concurrent clients doing
+a weighted mix of LS, small GETs, large GETs and PUTs, reporting ops/s,
+MB/s, p50/p99 latency per operation and the server's CPU time and peak RSS.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from protocol import BufferedSocket
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(HERE, 'ftp_server.py')
+
+# server flags for each GET mode; 'legacy' mirrors the old 4 KB read()/sendall() loop
+GET_MODES = {
+    'legacy': ['--no-sendfile', '--chunk-size', '4096'],
+    'chunked': ['--no-sendfile'],
+    'sendfile': [],
+}
+
+def parse_size(text):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_size(n):
+    for unit in ('G', 'M', 'K'):
+        scale = {'G': 1024 ** 3, 'M': 1024 ** 2, 'K': 1024}[unit]
+        if n >= scale and n % scale == 0:
+            return f"{n // scale}{unit}"
+    return str(n)
+
+def make_file(path, size):
+    # repeat one random block so files are not sparse and do not compress
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            n = min(len(block), remaining)
+            f.write(block[:n])
+            remaining -= n
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(base_dir, extra_args, engine='threads'):
+    port = free_port()
+    cmd = [sys.executable, SERVER, '-p', str(port), '-d', base_dir, '--engine', engine] + extra_args
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def timed_get(sock, name, bufsize=1024 * 1024):
+    """GET name on an open connection, discarding the data; returns (bytes, seconds)."""
+    start = time.perf_counter()
+    sock.sendall(f"GET {name}\n".encode())
+    header = sock.readline()
+    if not header or not header.startswith(b'OK '):
+        raise RuntimeError(f"GET {name} failed: {header!r}")
+    size = int(header.split()[1])
+    buf = bytearray(bufsize)
+    got = 0
+    with memoryview(buf) as view:
+        while got < size:
+            n = sock.readinto(view[:min(bufsize, size - got)])
+            if not n:
+                raise RuntimeError("connection closed mid-transfer")
+            got += n
+    return size, time.perf_counter() - start
+
+def bench_get(args):
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    with tempfile.TemporaryDirectory() as base_dir:
+        for size in sizes:
+            make_file(os.path.join(base_dir, f"file_{size}"), size)
+        print(f"{'size':>8} " + ' '.join(f"{m + ' MB/s':>14}" for m in modes))
+        results = {size: {} for size in sizes}
+        for mode in modes:
+            proc, port = start_server(base_dir, GET_MODES[mode], args.engine)
+            try:
+                with BufferedSocket(socket.create_connection(('127.0.0.1', port))) as sock:
+                    for size in sizes:
+                        best = None
+                        for _ in range(args.repeat):
+                            n, secs = timed_get(sock, f"file_{size}")
+                            best = secs if best is None else min(best, secs)
+                        results[size][mode] = n / best / 1e6
+            finally:
+                stop_server(proc)
+        for size in sizes:
+            print(f"{format_size(size):>8} " + ' '.join(f"{results[size][m]:>14.1f}" for m in modes))
+
+LOAD_OPS = ('ls', 'small', 'large', 'put')
+
+def parse_mix(text):
+    """Parse 'ls=20,small=60,...' into parallel lists of ops and weights."""
+    ops, weights = [], []
+    for item in text.split(','):
+        op, _, weight = item.partition('=')
+        if op not in LOAD_OPS:
+            raise ValueError(f"unknown op {op!r}, expected one of {', '.join(LOAD_OPS)}")
+        ops.append(op)
+        weights.append(float(weight or 1))
+    return ops, weights
+
+def proc_usage(pid):
+    """Return (cpu_seconds, peak_rss_bytes) of a process from /proc, or (None, None)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime + stime
+        with open(f"/proc/{pid}/status") as f:
+            hwm = next(line for line in f if line.startswith('VmHWM:'))
+        return cpu, int(hwm.split()[1]) * 1024
+    except (OSError, StopIteration, ValueError, IndexError):
+        return None, None
+
+def percentile(values, q):
+    # values must be sorted
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def ls_once(sock):
+    sock.sendall(b"LS\n")
+    header = sock.readline()
+    if not header or not header.startswith(b'OK '):
+        raise RuntimeError(f"LS failed: {header!r}")
+    size = int(header.split()[1])
+    if sock.readexactly(size) is None:
+        raise RuntimeError("connection closed mid-listing")
+    return size
+
+def put_once(sock, name, data):
+    sock.sendall(f"PUT {name}\n".encode())
+    header = sock.readline()
+    if not header or not header.startswith(b'OK '):
+        raise RuntimeError(f"PUT {name} failed: {header!r}")
+    sock.sendall(f"SIZE {len(data)}\n".encode())
+    sock.sendall(data)
+    reply = sock.readline()
+    if not reply or not reply.startswith(b'OK '):
+        raise RuntimeError(f"PUT {name} failed: {reply!r}")
+    return len(data)
+
+def load_client(port, client_id, args, ops, weights, deadline, samples, errors):
+    """One simulated user: run random ops until the deadline, recording (op, secs, bytes).
+
+    errors is this client's own dict of failure counts, merged once every client is done.
+    """
+    rng = random.Random(client_id)
+    put_data = os.urandom(args.put_size)
+    sock = None
+    try:
+        while time.monotonic() < deadline:
+            if sock is None:
+                try:
+                    sock = BufferedSocket(socket.create_connection(('127.0.0.1', port)))
+                except OSError:
+                    errors['connect'] = errors.get('connect', 0) + 1
+                    return
+            op = rng.choices(ops, weights)[0]
+            start = time.perf_counter()
+            try:
+                if op == 'ls':
+                    n = ls_once(sock)
+                elif op == 'small':
+                    n, _ = timed_get(sock, f"small_{rng.randrange(args.small_files)}")
+                elif op == 'large':
+                    n, _ = timed_get(sock, 'large')
+                else:
+                    n = put_once(sock, f"put_{client_id}", put_data)
+            except (RuntimeError, OSError):
+                errors[op] = errors.get(op, 0) + 1
+                # part of the reply may still be in flight: carry on over a fresh connection
+                sock.close()
+                sock = None
+                continue
+            samples.append((op, time.perf_counter() - start, n))
+    finally:
+        if sock is not None:
+            sock.close()
+
+def run_load(base_dir, engine, args, ops, weights):
+    proc, port = start_server(base_dir, [], engine)
+    try:
+        samples = []
+        client_errors = [{} for _ in range(args.clients)]
+        cpu_before, _ = proc_usage(proc.pid)
+        start = time.monotonic()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=load_client,
+                                    args=(port, i, args, ops, weights, deadline, samples, client_errors[i]))
+                   for i in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        errors = {}
+        for counts in client_errors:
+            for op, n in counts.items():
+                errors[op] = errors.get(op, 0) + n
+        elapsed = time.monotonic() - start
+        cpu_after, rss = proc_usage(proc.pid)
+    finally:
+        stop_server(proc)
+    result = {
+        'engine': engine,
+        'clients': args.clients,
+        'seconds': round(elapsed, 3),
+        'ops': len(samples),
+        'ops_per_sec': round(len(samples) / elapsed, 1),
+        'mb_per_sec': round(sum(n for _, _, n in samples) / elapsed / 1e6, 1),
+        'errors': errors,
+        'server_cpu_seconds': None if cpu_before is None else round(cpu_after - cpu_before, 2),
+        'server_cpu_percent': None if cpu_before is None else round((cpu_after - cpu_before) / elapsed * 100, 1),
+        'server_peak_rss_mb': None if rss is None else round(rss / 1e6, 1),
+        'by_op': {},
+    }
+    for op in ops:
+        secs = sorted(s for o, s, _ in samples if o == op)
+        result['by_op'][op] = {
+            'count': len(secs),
+            'ops_per_sec': round(len(secs) / elapsed, 1),
+            'p50_ms': round(percentile(secs, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(secs, 0.99) * 1000, 2),
+        }
+    return result
+
+def print_load(result):
+    print(f"engine={result['engine']} clients={result['clients']} {result['seconds']}s: "
+          f"{result['ops_per_sec']} ops/s, {result['mb_per_sec']} MB/s, "
+          f"server cpu {result['server_cpu_percent']}% peak rss {result['server_peak_rss_mb']} MB"
+          + (f", errors {result['errors']}" if result['errors'] else ''))
+    print(f"  {'op':<6} {'count':>8} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for op, stats in result['by_op'].items():
+        print(f"  {op:<6} {stats['count']:>8} {stats['ops_per_sec']:>10} {stats['p50_ms']:>10} {stats['p99_ms']:>10}")
+
+def bench_load(args):
+    ops, weights = parse_mix(args.mix)
+    results = []
+    with tempfile.TemporaryDirectory() as base_dir:
+        for i in range(args.small_files):
+            make_file(os.path.join(base_dir, f"small_{i}"), args.small_size)
+        make_file(os.path.join(base_dir, 'large'), args.large_size)
+        for engine in args.engine.split(','):
+            result = run_load(base_dir, engine, args, ops, weights)
+            results.append(result)
+            if not args.json:
+                print_load(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for ftp_server.py")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p_get = sub.add_parser('get', help='GET throughput per file size, before/after sendfile')
+    p_get.add_argument('--sizes', default='1M,16M,256M', help='Comma separated file sizes (default 1M,16M,256M)')
+    p_get.add_argument('--modes', default='legacy,chunked,sendfile',
+                       help=f"Comma separated GET modes from {', '.join(GET_MODES)}")
+    p_get.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    p_get.add_argument('--repeat', type=int, default=3, help='Runs per size, best is reported (default 3)')
+    p_load = sub.add_parser('load', help='Concurrent clients running a mix of LS/GET/PUT')
+    p_load.add_argument('--clients', type=int, default=20, help='Concurrent client connections (default 20)')
+    p_load.add_argument('--duration', type=float, default=10, help='Seconds to run per engine (default 10)')
+    p_load.add_argument('--mix', default='ls=20,small=60,large=10,put=10',
+                        help='Weighted ops from ls, small, large, put (default ls=20,small=60,large=10,put=10)')
+    p_load.add_argument('--engine', default='threads', help='Comma separated engines to compare (default threads)')
+    p_load.add_argument('--small-files', type=int, default=100, help='Number of small files (default 100)')
+    p_load.add_argument('--small-size', type=parse_size, default='4K', help='Size of each small file (default 4K)')
+    p_load.add_argument('--large-size', type=parse_size, default='16M', help='Size of the large file (default 16M)')
+    p_load.add_argument('--put-size', type=parse_size, default='64K', help='Bytes per PUT (default 64K)')
+    p_load.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    if args.bench == 'get':
+        bench_get(args)
+    elif args.bench == 'load':
+        bench_load(args)
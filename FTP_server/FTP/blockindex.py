@@ -0,0 +1,178 @@
+"""Persistent content-addressed index of the blocks in a served directory.
+
+Every regular file is split into BLOCK_SIZE blocks and each block is known
+by its sha256 digest, so a DPUT can reuse any block the server already has,
+whichever file it lives in. The index is refreshed one directory at a time,
+rehashing only files whose (mtime, size, inode) changed since they were
+indexed, and saved outside the served directory, where clients cannot list,
+download or overwrite it: by default as .<dirname>.blockindex next to it.
+The file is only a cache: blocks taken from it are checked against their
+digest before they are used, and paths in it that leave base_dir are refused.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+BLOCK_SIZE = 64 * 1024
+INDEX_SUFFIX = '.blockindex'
+SAVE_INTERVAL = 10.0  # seconds between writes of a changed index
+
+def file_digests(path, block_size=BLOCK_SIZE, hasher=None):
+    """sha256 digest of each block_size block of path, in order.
+
+    hasher, if given, is also fed the whole file.
+    """
+    digests = []
+    buf = bytearray(block_size)
+    with open(path, 'rb') as f, memoryview(buf) as view:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digests.append(hashlib.sha256(view[:n]).digest())
+            if hasher:
+                hasher.update(view[:n])
+    return digests
+
+def stamp_of(st):
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def default_index_path(base_dir):
+    base_dir = os.path.abspath(base_dir)
+    return os.path.join(os.path.dirname(base_dir), '.' + os.path.basename(base_dir) + INDEX_SUFFIX)
+
+def inside_base(base_dir, rel):
+    # a relative path naming something below base_dir once normalised
+    if os.path.isabs(rel) or os.path.splitdrive(rel)[0]:
+        return False
+    full = os.path.normpath(os.path.join(base_dir, rel))
+    return full != base_dir and os.path.commonpath([base_dir, full]) == base_dir
+
+class BlockIndex:
+    """Maps block digests to (path, offset) for the files under base_dir."""
+
+    def __init__(self, base_dir, block_size=BLOCK_SIZE, index_path=None):
+        self.base_dir = os.path.abspath(base_dir)
+        self.block_size = block_size
+        self.index_path = os.path.abspath(index_path or default_index_path(base_dir))
+        self._files = {}   # relpath -> [stamp, [digest, ...]]
+        self._blocks = {}  # digest -> {relpath: block number} of every file holding it
+        self._dirty = False
+        self._saved = float('-inf')
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+            if data.get('block_size') != self.block_size:
+                return  # built with another block size: start over
+            files = {}
+            for rel, (stamp, digests) in data['files'].items():
+                if not inside_base(self.base_dir, rel):
+                    raise ValueError(f"path outside the served directory: {rel}")
+                files[os.path.normpath(rel)] = (list(stamp), [bytes.fromhex(d) for d in digests])
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return  # unreadable or malformed: rebuild it from the files
+        for rel, (stamp, digests) in files.items():
+            self._set(rel, stamp, digests)
+
+    def _set(self, rel, stamp, digests):
+        self._drop(rel)
+        self._files[rel] = [stamp, digests]
+        for i, digest in enumerate(digests):
+            self._blocks.setdefault(digest, {}).setdefault(rel, i)
+        self._dirty = True
+
+    def _drop(self, rel):
+        old = self._files.pop(rel, None)
+        if old is None:
+            return
+        for digest in old[1]:
+            holders = self._blocks.get(digest)
+            if holders is not None:
+                holders.pop(rel, None)
+                if not holders:
+                    del self._blocks[digest]
+        self._dirty = True
+
+    def refresh_dir(self, path):
+        """Bring the entries for the files directly in path up to date."""
+        rel_dir = os.path.normpath(os.path.relpath(path, self.base_dir))
+        present = set()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.') or entry.name.endswith('.part'):
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stamp = stamp_of(entry.stat())
+                except OSError:
+                    continue
+                rel = os.path.normpath(os.path.join(rel_dir, entry.name))
+                present.add(rel)
+                with self._lock:
+                    current = self._files.get(rel)
+                if current is not None and current[0] == stamp:
+                    continue
+                try:
+                    digests = file_digests(entry.path, self.block_size)
+                except OSError:
+                    continue
+                with self._lock:
+                    self._set(rel, stamp, digests)
+        with self._lock:
+            for rel in [r for r in self._files if (os.path.dirname(r) or '.') == rel_dir
+                        and r not in present]:
+                self._drop(rel)
+        self.save()
+
+    def lookup(self, digests):
+        """For each digest return (absolute path, offset) of a block we hold, or None."""
+        with self._lock:
+            # any holder will do; the copy is checked against its digest anyway
+            found = [next(iter(self._blocks[d].items())) if d in self._blocks else None
+                     for d in digests]
+        return [None if f is None else (os.path.join(self.base_dir, f[0]), f[1] * self.block_size)
+                for f in found]
+
+    def add(self, path, digests):
+        """Record a file just written with the given block digests."""
+        rel = os.path.relpath(path, self.base_dir)
+        stamp = stamp_of(os.stat(path))
+        with self._lock:
+            self._set(rel, stamp, digests)
+        self.save()
+
+    def discard(self, path):
+        """Forget path, which was replaced or no longer matches its indexed blocks."""
+        rel = os.path.relpath(os.path.abspath(path), self.base_dir)
+        if not inside_base(self.base_dir, rel):
+            return
+        with self._lock:
+            self._drop(os.path.normpath(rel))
+        self.save()
+
+    def save(self, force=False):
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved < SAVE_INTERVAL):
+                return
+            data = {
+                'block_size': self.block_size,
+                'files': {rel: [stamp, [d.hex() for d in digests]]
+                          for rel, (stamp, digests) in self._files.items()},
+            }
+            self._dirty = False
+            self._saved = time.monotonic()
+        tmp = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.index_path)
+        except OSError:
+            with self._lock:
+                self._dirty = True
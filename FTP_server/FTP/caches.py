@@ -0,0 +1,362 @@
+"""Shared in-memory caches used by ftp_server.py."""
+import hashlib
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Entries whose directory changed less than this long ago are not cached: on
+# file systems with coarse timestamps a second change in the same tick would
+# leave the mtime untouched and the cached listing stale.
+RACY_WINDOW = 1.0
+
+class ListingCache:
+    """LRU cache of encoded LS payloads keyed by directory path.
+
+    An entry is valid while the directory's (mtime, inode) is unchanged;
+    creating, removing or renaming an entry bumps the directory mtime, so the
+    next LS misses and relists. The cache is bounded both by entry count and by
+    total payload bytes and is safe to share between threads.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()  # path -> (stamp, payload)
+        self._lock = threading.Lock()
+
+    def listing(self, path):
+        """Return the newline-joined names in path, encoded."""
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        payload = '\n'.join(os.listdir(path)).encode()
+        if self.max_entries and time.time() - st.st_mtime >= RACY_WINDOW:
+            self._store(path, stamp, payload)
+        return payload
+
+    def _store(self, path, stamp, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[path] = (stamp, payload)
+            self._bytes += len(payload)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class CompressedCache:
+    """LRU cache of zlib-compressed file bodies for GET -z, keyed by path.
+
+    An entry is valid while the file's (mtime, size, inode) is unchanged. A
+    file is only compressed into the cache on its admit_after-th request and
+    only if it is at most max_file bytes, so one-off and huge downloads are
+    streamed instead of churning the cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file=8 * 1024 * 1024, admit_after=2):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.admit_after = admit_after
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()  # path -> (stamp, chunks, nbytes)
+        self._seen = OrderedDict()     # path -> (stamp, requests) not yet admitted
+        self._lock = threading.Lock()
+
+    def get(self, path, st, build):
+        """Return the cached chunks of a file, calling build() to fill a miss once
+        the file is popular enough; None means the caller should stream it."""
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if not self.max_bytes or st.st_size > self.max_file or time.time() - st.st_mtime < RACY_WINDOW:
+                return None
+            seen = self._seen.pop(path, None)
+            requests = seen[1] + 1 if seen is not None and seen[0] == stamp else 1
+            if requests < self.admit_after:
+                self._seen[path] = (stamp, requests)
+                while len(self._seen) > 4096:
+                    self._seen.popitem(last=False)
+                return None
+        chunks = [chunk for chunk in build() if chunk]
+        self._store(path, stamp, chunks)
+        return chunks
+
+    def _store(self, path, stamp, chunks):
+        nbytes = sum(len(chunk) for chunk in chunks)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[path] = (stamp, chunks, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class DigestCache:
+    """sha256 of whole files keyed by path, valid while (mtime, size, inode) match.
+
+    Filled by HASH, which reads the file once, by uploads, which hash the
+    data as it is written so a fresh file never needs a second read, and by
+    whole-file GETs, which hash the data as it is sent (see hasher()).
+    """
+
+    def __init__(self, max_entries=100000, read_size=1024 * 1024):
+        self.max_entries = max_entries
+        self.read_size = read_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> (stamp, hexdigest)
+        self._lock = threading.Lock()
+
+    def peek(self, path, st):
+        """Return the cached digest for a file with stat st, or None."""
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def digest(self, path):
+        """Return the hex sha256 of path, reading the file only on a miss."""
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            cached = self.peek(path, st)
+            if cached is not None:
+                return cached
+            h = hashlib.sha256()
+            buf = bytearray(self.read_size)
+            with memoryview(buf) as view:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+            hexdigest = h.hexdigest()
+            self.learn(path, st, hexdigest, f)
+        return hexdigest
+
+    def hasher(self, st):
+        """A sha256 to learn the digest of a file with stat st while it is read for
+        something else, or None if it could not be stored anyway."""
+        if not self.max_entries or time.time() - st.st_mtime < RACY_WINDOW:
+            return None
+        return hashlib.sha256()
+
+    def learn(self, path, st, hexdigest, f=None):
+        """Store the digest of a file read with stat st (through f if given), unless
+        it changed while it was read or may change again unseen."""
+        try:
+            after = os.fstat(f.fileno()) if f is not None else os.stat(path)
+        except OSError:
+            return
+        if (after.st_mtime_ns, after.st_size) == (st.st_mtime_ns, st.st_size) \
+                and time.time() - st.st_mtime >= RACY_WINDOW:
+            self.store(path, st, hexdigest)
+
+    def store(self, path, st, hexdigest):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = ((st.st_mtime_ns, st.st_size, st.st_ino), hexdigest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class FileCache:
+    """Read-through LRU cache of hot file contents for GET, keyed by path.
+
+    An entry is valid while the file's (mtime, size, inode) is unchanged.
+    Files up to max_file bytes are held as bytes, within max_bytes in total;
+    larger ones up to max_mapped bytes are kept as read-only mmap views, which
+    cost address space rather than heap. Like CompressedCache a file is only
+    loaded on its admit_after-th request. Mapped entries are never closed
+    explicitly: a GET still sending from one keeps it alive after eviction.
+    Mapping is off by default (max_mapped=0), so larger files go out with
+    sendfile: the server replaces files by rename, which leaves an old mapping
+    intact, but reading a mapping of a file another program truncated in place
+    raises SIGBUS and kills the process. Only enable it for directories no
+    other program writes to.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file=1024 * 1024,
+                 max_mapped=0, admit_after=2):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.max_mapped = max_mapped
+        self.admit_after = admit_after
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._mapped = 0
+        self._entries = OrderedDict()  # path -> (stamp, body)
+        self._seen = OrderedDict()     # path -> (stamp, requests) not yet admitted
+        self._lock = threading.Lock()
+
+    def _limit(self, size):
+        # the budget a file of this size is charged to, 0 if it is not cacheable
+        if size <= self.max_file:
+            return self.max_bytes
+        return self.max_mapped
+
+    def get(self, path, st):
+        """Return the contents of the file with stat st (bytes or mmap), or None
+        if the caller should read it from disk itself."""
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if st.st_size > self._limit(st.st_size) or time.time() - st.st_mtime < RACY_WINDOW:
+                return None
+            seen = self._seen.pop(path, None)
+            requests = seen[1] + 1 if seen is not None and seen[0] == stamp else 1
+            if requests < self.admit_after:
+                self._seen[path] = (stamp, requests)
+                while len(self._seen) > 4096:
+                    self._seen.popitem(last=False)
+                return None
+        body = self._load(path, stamp)
+        if body is not None:
+            self._store(path, stamp, body)
+        return body
+
+    def _load(self, path, stamp):
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_mtime_ns, st.st_size, st.st_ino) != stamp:
+                    return None  # changed since the caller looked
+                if st.st_size <= self.max_file:
+                    return f.read()
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path, stamp, body):
+        mapped = isinstance(body, mmap.mmap)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._forget(old[1])
+            self._entries[path] = (stamp, body)
+            if mapped:
+                self._mapped += len(body)
+            else:
+                self._bytes += len(body)
+            while self._bytes > self.max_bytes or self._mapped > self.max_mapped:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._forget(evicted)
+                self.evictions += 1
+
+    def _forget(self, body):
+        if isinstance(body, mmap.mmap):
+            self._mapped -= len(body)
+        else:
+            self._bytes -= len(body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'mapped': self._mapped,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class PathCache:
+    """LRU memo of path arithmetic that depends only on its inputs.
+
+    CWD resolves paths lexically (abspath, no symlinks), so for a given
+    (base_dir, current_dir, arg) the canonical target, whether it lies inside
+    base_dir and its PWD payload never change and need no invalidation. What
+    can change, whether the directory exists, is left to the caller to stat.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> value
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Return the value for key, calling build() to compute a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = build()
+        if self.max_entries:
+            with self._lock:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
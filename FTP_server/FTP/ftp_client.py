@@ -2,25 +2,146 @@ import socket
 import argparse
 import os
 import sys
+import time
+import glob
+import fnmatch
+import threading
+import asyncio
+import zlib
+import hashlib
+from collections import deque, namedtuple
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from protocol import (BufferedSocket, CHUNKED, chunk_header, iter_chunks, iter_chunks_async,
+                      split_flag, reply_digest, deflate_file, Inflater)
+from blockindex import file_digests
+
+CHUNK_SIZE = 1024 * 1024  # receive buffer for file downloads
+PGET_SEGMENT_MIN = 8 * 1024 * 1024  # auto-tuning: one connection per this many bytes
+PGET_MAX_CONNECTIONS = 8
+PIPELINE_DEPTH = 32  # requests MGET/MPUT keep in flight ahead of the replies
 
 def recvall(sock, n):
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
+    return sock.readexactly(n)
 
 def recv_line(sock):
-    line = b''
-    while not line.endswith(b'\n'):
-        chunk = sock.recv(1)
-        if not chunk:
-            return None
-        line += chunk
+    line = sock.readline()
+    if line is None:
+        return None
     return line.decode().strip()
 
+class Progress:
+    """One-line transfer meter: redrawn on a terminal, summary line at the end."""
+
+    def __init__(self, label, total, interval=0.5):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = self.last = time.monotonic()
+        self.live = sys.stdout.isatty()
+        self._lock = threading.Lock()  # PGET workers share one meter
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start
+        return self.done / elapsed / 1e6 if elapsed > 0 else 0.0
+
+    def update(self, n):
+        with self._lock:
+            self.done += n
+            now = time.monotonic()
+            if not (self.live and now - self.last >= self.interval):
+                return
+            self.last = now
+            pct = 100.0 * self.done / self.total if self.total else 100.0
+            print(f"\r{self.label}: {self.done}/{self.total} bytes ({pct:.0f}%) {self.rate():.1f} MB/s",
+                  end='', flush=True)
+
+    def finish(self):
+        if self.live:
+            print('\r', end='')
+        elapsed = time.monotonic() - self.start
+        print(f"{self.label}: {self.done} bytes in {elapsed:.2f}s ({self.rate():.1f} MB/s)")
+
+def recv_to_file(sock, f, size, progress=None, hasher=None):
+    """Copy size bytes from sock into f through one reusable buffer.
+
+    Returns the number of bytes written, which is less than size if the
+    connection closed early. hasher, if given, is updated with every chunk.
+    """
+    buf = bytearray(min(CHUNK_SIZE, size) or 1)
+    got = 0
+    with memoryview(buf) as view:
+        while got < size:
+            n = sock.readinto(view[:min(len(buf), size - got)])
+            if not n:
+                break
+            f.write(view[:n])
+            if hasher:
+                hasher.update(view[:n])
+            got += n
+            if progress:
+                progress.update(n)
+    return got
+
+def hash_prefix(hasher, path, length):
+    """Feed the first length bytes of a local file to hasher (for resumed transfers)."""
+    with open(path, 'rb') as f:
+        while length:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            hasher.update(data)
+            length -= len(data)
+
+def check_digest(hasher, expected):
+    if expected is None:
+        print("Could not get the remote checksum")
+    elif hasher.hexdigest() == expected:
+        print("sha256 verified")
+    else:
+        print(f"Checksum mismatch: local {hasher.hexdigest()}, remote {expected}")
+
+def recv_compressed(sock, f, hasher=None):
+    """Write a GET -z body (a chunked zlib stream) into f; returns (bytes written, bytes received).
+
+    Raises IOError if the server aborted the stream and zlib.error if the data
+    was corrupt, in which case the rest of the stream is drained first.
+    """
+    inflater = Inflater()
+    raw = wire = 0
+    chunks = iter_chunks(sock)
+    try:
+        for chunk in chunks:
+            wire += len(chunk)
+            for piece in inflater.feed(chunk):
+                f.write(piece)
+                if hasher:
+                    hasher.update(piece)
+                raw += len(piece)
+        tail = inflater.finish()
+    except zlib.error:
+        for _ in chunks:
+            pass
+        raise
+    f.write(tail)
+    if hasher:
+        hasher.update(tail)
+    return raw + len(tail), wire
+
+def send_compressed(sock, f, offset, size, hasher=None):
+    """Send size bytes of f from offset as a PUT -z body; returns the compressed size."""
+    sock.write(f"SIZE {CHUNKED}\n".encode())
+    wire = 0
+    for chunk in deflate_file(f, offset, size, CHUNK_SIZE, hasher=hasher):
+        if chunk:
+            sock.write(chunk_header(len(chunk)))
+            sock.write(chunk)
+            wire += len(chunk)
+    sock.write(chunk_header(0))
+    sock.flush()
+    return wire
+
 def handle_ok_payload(sock, header):
     # header like "OK <size>"
     parts = header.split()
@@ -39,43 +160,250 @@ def handle_ok_payload(sock, header):
         # no size provided, just print header
         print(header)
 
-def cmd_list(sock):
+def remote_list(sock):
+    """Return the names in the remote directory, or None on error."""
     sock.sendall(b"LS\n")
     header = recv_line(sock)
+    if header is None or not header.startswith("OK "):
+        return None
+    data = recvall(sock, int(header.split()[1]))
+    if data is None:
+        return None
+    return [name for name in bytes(data).decode().split('\n') if name]
+
+def parse_mlsd(line):
+    """Split an 'LS -l' line ('type=file;size=1;modify=...; name') into a dict."""
+    facts, _, name = line.partition('; ')
+    entry = dict(fact.split('=', 1) for fact in facts.split(';') if '=' in fact)
+    if 'size' in entry:
+        entry['size'] = int(entry['size'])
+    entry['name'] = name
+    return entry
+
+def cmd_list(sock, arg=''):
+    # 'LS -l' and 'LS <offset> <limit>' come back chunked and are printed as they stream in
+    sock.sendall(f"LS {arg}\n".encode() if arg else b"LS\n")
+    header = recv_line(sock)
     if header is None:
         print("Connection lost")
         return
-    if header.startswith("OK "):
+    if header == f"OK {CHUNKED}":
+        try:
+            for chunk in iter_chunks(sock):
+                sys.stdout.write(bytes(chunk).decode())
+        except IOError as e:
+            print(e)
+    elif header.startswith("OK "):
         handle_ok_payload(sock, header)
     else:
         print(header)
 
-def cmd_get(sock, filename):
-    sock.sendall(f"GET {filename}\n".encode())
+def remote_hash(sock, filename):
+    """Return the sha256 of a remote file, or None on error."""
+    sock.sendall(f"HASH {filename}\n".encode())
+    header = recv_line(sock)
+    if header is None or not header.startswith("OK "):
+        return None
+    data = recvall(sock, int(header.split()[1]))
+    return bytes(data).decode() if data is not None else None
+
+def remote_size(sock, filename):
+    """Return the size of a remote file, or None if the server has no such file."""
+    sock.sendall(f"SIZE {filename}\n".encode())
+    header = recv_line(sock)
+    if header is None or not header.startswith("OK "):
+        return None
+    data = recvall(sock, int(header.split()[1]))
+    return int(data) if data is not None else None
+
+def start_get(sock, filename, offset=0, length=None):
+    """Request filename (or a byte range of it) and read the reply headers.
+
+    REST and GET go out in one write. Returns (count, sha256, None) when the
+    server is about to send count bytes (sha256 is None unless the server sent
+    it), else (None, None, error_header).
+    """
+    request = f"GET {filename}\n"
+    if offset or length is not None:
+        rest = f"REST {offset}" if length is None else f"REST {offset} {length}"
+        request = rest + "\n" + request
+    sock.sendall(request.encode())
+    if request.startswith("REST"):
+        header = recv_line(sock)
+        if header is None or not header.startswith("OK"):
+            # REST failed, so the GET that followed fetches the whole file: drain it
+            reply = recv_line(sock)
+            if reply and reply.startswith("OK "):
+                with open(os.devnull, 'wb') as sink:
+                    recv_to_file(sock, sink, int(reply.split()[1]))
+            return None, None, header or "Connection lost"
     header = recv_line(sock)
     if header is None:
-        print("Connection lost")
+        return None, None, "Connection lost"
+    if not header.startswith("OK "):
+        return None, None, header
+    return int(header.split()[1]), reply_digest(header), None
+
+def cmd_get_compressed(sock, filename, verify=False):
+    outname = os.path.basename(filename)
+    sock.sendall(f"GET -z {filename}\n".encode())
+    header = recv_line(sock)
+    if header != f"OK {CHUNKED}":
+        print(header or "Connection lost")
         return
-    if header.startswith("OK "):
-        size = int(header.split()[1])
-        outname = os.path.basename(filename)
-        print(f"Receiving {outname} ({size} bytes)")
-        received = recvall(sock, size)
-        if received is None:
-            print("Transfer failed")
-            return
+    start = time.monotonic()
+    hasher = hashlib.sha256() if verify else None
+    try:
         with open(outname, 'wb') as f:
-            f.write(received)
-        print("Saved as", outname)
+            raw, wire = recv_compressed(sock, f, hasher)
+    except (IOError, zlib.error) as e:
+        print(e)
+        print("Transfer failed")
+        return
+    elapsed = time.monotonic() - start
+    print(f"{outname}: {raw} bytes ({wire} compressed) in {elapsed:.2f}s")
+    print("Saved as", outname)
+    if verify:
+        check_digest(hasher, remote_hash(sock, filename))
+
+def cmd_get(sock, filename, resume=False, compress=False, verify=False):
+    """Download filename; verify=True checks its sha256 as the data streams in."""
+    if compress:
+        cmd_get_compressed(sock, filename, verify)
+        return
+    outname = os.path.basename(filename)
+    offset = 0
+    if resume and os.path.isfile(outname):
+        offset = os.path.getsize(outname)
+    size, digest, error = start_get(sock, filename, offset)
+    if error:
+        print(error)
+        return
+    if offset:
+        print(f"Resuming {outname} at byte {offset} ({size} bytes left)")
     else:
-        print(header)
+        print(f"Receiving {outname} ({size} bytes)")
+    hasher = hashlib.sha256() if verify else None
+    if hasher and offset:
+        hash_prefix(hasher, outname, offset)
+    progress = Progress(outname, size)
+    with open(outname, 'ab' if offset else 'wb') as f:
+        received = recv_to_file(sock, f, size, progress, hasher)
+    progress.finish()
+    if received < size:
+        print("Transfer failed")
+        return
+    print("Saved as", outname)
+    if verify:
+        check_digest(hasher, digest or remote_hash(sock, filename))
 
-def cmd_put(sock, filename):
+def remote_pwd(sock):
+    sock.sendall(b"PWD\n")
+    header = recv_line(sock)
+    if header is None or not header.startswith("OK "):
+        return None
+    data = recvall(sock, int(header.split()[1]))
+    return data.decode() if data is not None else None
+
+def pget_connections(size):
+    """Pick a connection count for a segmented download of size bytes."""
+    return max(1, min(PGET_MAX_CONNECTIONS, size // PGET_SEGMENT_MIN))
+
+def fetch_segment(host, port, cwd, filename, outname, offset, length, progress):
+    """Download one byte range on its own connection and write it in place."""
+    with BufferedSocket(socket.create_connection((host, port))) as sock:
+        if cwd and cwd != '/':
+            sock.sendall(f"CWD {cwd}\n".encode())
+            header = recv_line(sock)
+            if header is None or not header.startswith("OK "):
+                raise IOError(header or "Connection lost")
+            recvall(sock, int(header.split()[1]))
+        count, _, error = start_get(sock, filename, offset, length)
+        if error:
+            raise IOError(error)
+        buf = bytearray(min(CHUNK_SIZE, count) or 1)
+        pos = offset
+        with open(outname, 'r+b') as f, memoryview(buf) as view:
+            if not hasattr(os, 'pwrite'):
+                f.seek(offset)
+            while pos < offset + count:
+                n = sock.readinto(view[:min(len(buf), offset + count - pos)])
+                if not n:
+                    raise IOError("connection closed mid-transfer")
+                if hasattr(os, 'pwrite'):
+                    os.pwrite(f.fileno(), view[:n], pos)
+                else:
+                    f.write(view[:n])
+                pos += n
+                progress.update(n)
+        sock.sendall(b"QUIT\n")
+        recv_line(sock)
+
+def cmd_pget(sock, host, port, filename, connections=0):
+    """Download filename over several connections, each fetching a disjoint range."""
+    size = remote_size(sock, filename)
+    if size is None:
+        print("ERR file not found")
+        return
+    cwd = remote_pwd(sock)
+    n = connections or pget_connections(size)
+    outname = os.path.basename(filename)
+    # preallocate so every worker can write its range in place
+    with open(outname, 'wb') as f:
+        f.truncate(size)
+    segment = -(-size // n) if size else 0
+    ranges = [(off, min(segment, size - off)) for off in range(0, size, segment)] if size else []
+    print(f"Receiving {outname} ({size} bytes) over {len(ranges)} connection(s)")
+    progress = Progress(outname, size)
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as pool:
+        futures = [pool.submit(fetch_segment, host, port, cwd, filename, outname, off, length, progress)
+                   for off, length in ranges]
+        for fut in futures:
+            try:
+                fut.result()
+            except OSError as e:
+                failed.append(e)
+    progress.finish()
+    if failed:
+        print("Transfer failed:", failed[0])
+        return
+    print("Saved as", outname)
+
+def send_hashed(sock, f, offset, size, hasher):
+    # read, hash and send in one pass instead of sendfile
+    f.seek(offset)
+    buf = bytearray(min(CHUNK_SIZE, size) or 1)
+    with memoryview(buf) as view:
+        while size:
+            n = f.readinto(view[:min(len(buf), size)])
+            if not n:
+                raise IOError("local file shrank during upload")
+            hasher.update(view[:n])
+            sock.sendall(view[:n])
+            size -= n
+
+def cmd_put(sock, filename, resume=False, compress=False, verify=False):
+    """Upload filename; verify=True checks the sha256 the server computed."""
     if not os.path.exists(filename) or not os.path.isfile(filename):
         print("Local file not found")
         return
-    size = os.path.getsize(filename)
-    sock.sendall(f"PUT {os.path.basename(filename)}\n".encode())
+    name = os.path.basename(filename)
+    offset = 0
+    if resume:
+        # the server keeps an interrupted upload as <name>.part
+        offset = remote_size(sock, name + '.part') or 0
+        if offset > os.path.getsize(filename):
+            offset = 0
+        if offset:
+            sock.sendall(f"REST {offset}\n".encode())
+            header = recv_line(sock)
+            if header is None or not header.startswith("OK"):
+                print(header or "Connection lost")
+                return
+            print(f"Resuming upload of {name} at byte {offset}")
+    size = os.path.getsize(filename) - offset
+    sock.sendall(f"PUT -z {name}\n".encode() if compress else f"PUT {name}\n".encode())
     header = recv_line(sock)
     if header is None:
         print("Connection lost")
@@ -83,19 +411,173 @@ def cmd_put(sock, filename):
     if not header.startswith("OK"):
         print(header)
         return
-    # Send SIZE header and file
-    sock.sendall(f"SIZE {size}\n".encode())
-    with open(filename, 'rb') as f:
-        while True:
-            chunk = f.read(4096)
-            if not chunk:
-                break
-            sock.sendall(chunk)
+    hasher = hashlib.sha256() if verify else None
+    if hasher and offset:
+        hash_prefix(hasher, filename, offset)
+    if compress:
+        with open(filename, 'rb') as f:
+            wire = send_compressed(sock, f, offset, size, hasher)
+        print(f"Sent {size} bytes as {wire} compressed")
+    else:
+        # Send SIZE header and file
+        sock.sendall(f"SIZE {size}\n".encode())
+        with open(filename, 'rb') as f:
+            if hasher:
+                send_hashed(sock, f, offset, size, hasher)
+            elif size:
+                sock.sendfile(f, offset, size)
     final = recv_line(sock)
     if final:
         print(final)
     else:
         print("No final response")
+    if verify and final and final.startswith("OK"):
+        check_digest(hasher, reply_digest(final))
+
+def missing_runs(missing):
+    """Group ascending block numbers into (first, count) runs."""
+    runs = []
+    for i in missing:
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1][1] += 1
+        else:
+            runs.append([i, 1])
+    return runs
+
+def send_blocks(sock, f, missing, block_size, size):
+    # one sendfile per run of consecutive missing blocks
+    for first, count in missing_runs(missing):
+        offset = first * block_size
+        sock.sendfile(f, offset, min(count * block_size, size - offset))
+
+def cmd_dput(sock, filename, verify=False):
+    """Upload filename, sending only the blocks the server does not already hold."""
+    if not os.path.isfile(filename):
+        print("Local file not found")
+        return
+    name = os.path.basename(filename)
+    sock.sendall(f"DPUT {name}\n".encode())
+    header = recv_line(sock)
+    if header is None:
+        print("Connection lost")
+        return
+    if not header.startswith("OK blocks "):
+        print(header)
+        return
+    block_size = int(header.split()[2])
+    size = os.path.getsize(filename)
+    hasher = hashlib.sha256() if verify else None
+    digests = file_digests(filename, block_size, hasher)
+    sock.write(f"BLOCKS {size} {len(digests)}\n".encode())
+    sock.sendall(b''.join(digests))
+    header = recv_line(sock)
+    if header is None or not header.startswith("OK "):
+        print(header or "Connection lost")
+        return
+    data = recvall(sock, int(header.split()[1]))
+    if data is None:
+        print("Connection lost")
+        return
+    missing = [int(i) for i in bytes(data).split()]
+    print(f"Sending {len(missing)} of {len(digests)} blocks")
+    with open(filename, 'rb') as f:
+        send_blocks(sock, f, missing, block_size, size)
+    final = recv_line(sock)
+    print(final or "No final response")
+    if final and final.startswith("ERR"):
+        print("Falling back to a full upload")
+        cmd_put(sock, filename, verify=verify)
+    elif verify and final:
+        check_digest(hasher, reply_digest(final))
+
+def cmd_hash(sock, filename):
+    if not filename:
+        print("Usage: HASH <filename>")
+        return
+    digest = remote_hash(sock, filename)
+    print("File not found" if digest is None else digest)
+
+def cmd_size(sock, filename):
+    if not filename:
+        print("Usage: SIZE <filename>")
+        return
+    size = remote_size(sock, filename)
+    print("File not found" if size is None else size)
+
+def cmd_mget(sock, pattern):
+    """GET every remote file matching pattern, pipelining the requests."""
+    names = remote_list(sock)
+    if names is None:
+        print("Could not list remote directory")
+        return
+    names = fnmatch.filter(names, pattern)
+    if not names:
+        print("No remote files match", pattern)
+        return
+    start = time.monotonic()
+    total = sent = saved = 0
+    for name in names:
+        # keep up to PIPELINE_DEPTH requests queued; they go out with the next read
+        while sent < len(names) and sent - saved < PIPELINE_DEPTH:
+            sock.write(f"GET {names[sent]}\n".encode())
+            sent += 1
+        saved += 1
+        header = recv_line(sock)
+        if header is None:
+            print("Connection lost")
+            return
+        if not header.startswith("OK "):
+            print(f"{name}: {header}")
+            continue
+        size = int(header.split()[1])
+        with open(os.path.basename(name), 'wb') as f:
+            if recv_to_file(sock, f, size) < size:
+                print("Connection lost")
+                return
+        total += size
+        print(f"Saved {name} ({size} bytes)")
+    elapsed = time.monotonic() - start
+    print(f"{len(names)} file(s), {total} bytes in {elapsed:.2f}s")
+
+def cmd_mput(sock, pattern):
+    """PUT every local file matching a glob, pipelining PUT/SIZE/data."""
+    files = [path for path in sorted(glob.glob(pattern)) if os.path.isfile(path)]
+    if not files:
+        print("No local files match", pattern)
+        return
+    start = time.monotonic()
+    pending = deque()
+
+    def read_reply():
+        name = pending.popleft()
+        ready = recv_line(sock)
+        if ready is None or not ready.startswith("OK"):
+            # the server did not take the upload, so the rest of the stream is out of sync
+            raise IOError(f"{name}: {ready or 'Connection lost'}")
+        final = recv_line(sock)
+        if final is None:
+            raise IOError("Connection lost")
+        print(f"{name}: {final}")
+
+    total = 0
+    try:
+        for path in files:
+            size = os.path.getsize(path)
+            sock.write(f"PUT {os.path.basename(path)}\nSIZE {size}\n".encode())
+            if size:
+                with open(path, 'rb') as f:
+                    sock.sendfile(f, 0, size)
+            total += size
+            pending.append(os.path.basename(path))
+            if len(pending) >= PIPELINE_DEPTH:
+                read_reply()
+        while pending:
+            read_reply()
+    except IOError as e:
+        print(e)
+        return
+    elapsed = time.monotonic() - start
+    print(f"{len(files)} file(s), {total} bytes in {elapsed:.2f}s")
 
 def cmd_pwd(sock):
     sock.sendall(b"PWD\n")
@@ -108,6 +590,17 @@ def cmd_pwd(sock):
     else:
         print(header)
 
+def cmd_stat(sock):
+    sock.sendall(b"STAT\n")
+    header = recv_line(sock)
+    if header is None:
+        print("Connection lost")
+        return
+    if header.startswith("OK "):
+        handle_ok_payload(sock, header)
+    else:
+        print(header)
+
 def cmd_cwd(sock, arg):
     if not arg:
         print("Usage: CWD <directory>")
@@ -122,43 +615,698 @@ def cmd_cwd(sock, arg):
     else:
         print(header)
 
-def interactive(host, port):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+class FTPError(Exception):
+    """An ERR reply from the server."""
+
+TransferResult = namedtuple('TransferResult', 'remote local size seconds')
+
+def ls_request(long=False, offset=0, limit=None):
+    args = ['-l'] if long else []
+    if offset or limit is not None:
+        args.append(str(offset))
+    if limit is not None:
+        args.append(str(limit))
+    return ("LS " + " ".join(args) + "\n").encode()
+
+def rest_request(offset, length=None):
+    # checked here so the server never rejects the REST ahead of a pipelined GET
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("offset and length must be >= 0")
+    return (f"REST {offset}\n" if length is None else f"REST {offset} {length}\n").encode()
+
+class FTPClient:
+    """Scriptable client: methods return data and raise FTPError on ERR replies.
+
+    If the connection drops, the call reconnects once, restores the working
+    directory and tries again. Use it as a context manager, or get it from a
+    ConnectionPool so warm connections are reused across jobs. With
+    verify=True whole-file transfers are checked against the server's sha256
+    as they stream and a mismatch raises FTPError.
+    """
+
+    def __init__(self, host='127.0.0.1', port=2121, timeout=None, verify=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.verify = verify
+        self.sock = None
+        self.cwd_path = '/'
+        self.last_used = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        raw = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        raw.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = BufferedSocket(raw)
+        if self.cwd_path != '/':
+            self.sock.sendall(f"CWD {self.cwd_path}\n".encode())
+            self._payload(self._reply())
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendall(b"QUIT\n")
+            recv_line(self.sock)
+        except OSError:
+            pass
+        self._drop()
+
+    def _drop(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.sock = None
+
+    def _reply(self):
+        line = recv_line(self.sock)
+        if line is None:
+            raise ConnectionError("connection lost")
+        if not line.startswith("OK"):
+            raise FTPError(line)
+        return line
+
+    def _payload(self, header):
+        data = recvall(self.sock, int(header.split()[1]))
+        if data is None:
+            raise ConnectionError("connection lost")
+        return bytes(data)
+
+    def _call(self, op, *args):
+        for attempt in (1, 2):
+            if self.sock is None:
+                self.connect()
+            try:
+                result = op(*args)
+                self.last_used = time.monotonic()
+                return result
+            except (ConnectionError, socket.timeout):
+                self._drop()
+                if attempt == 2:
+                    raise
+
+    def _simple(self, request):
+        self.sock.sendall(request)
+        return self._payload(self._reply()).decode()
+
+    def _noop(self):
+        self.sock.sendall(b"NOOP\n")
+        self._reply()
+
+    def noop(self):
+        self._call(self._noop)
+
+    def _ls_chunked(self, request):
+        self.sock.sendall(request)
+        self._reply()
+        try:
+            data = b''.join(bytes(chunk) for chunk in iter_chunks(self.sock))
+        except IOError as e:
+            if isinstance(e, ConnectionError):
+                raise
+            raise FTPError(str(e))
+        return data.decode().splitlines()
+
+    def ls(self, long=False, offset=0, limit=None):
+        """Names in the current remote directory.
+
+        long=True returns dicts with name/type/size/modify instead; offset and
+        limit fetch one page of a large directory.
+        """
+        if not long and not offset and limit is None:
+            return [name for name in self._call(self._simple, b"LS\n").split('\n') if name]
+        lines = self._call(self._ls_chunked, ls_request(long, offset, limit))
+        return [parse_mlsd(line) for line in lines] if long else lines
+
+    def pwd(self):
+        return self._call(self._simple, b"PWD\n")
+
+    def stat(self):
+        """The server's STAT report, one metric per line."""
+        return self._call(self._simple, b"STAT\n")
+
+    def cwd(self, path):
+        """Change the remote directory; returns the new PWD."""
+        self.cwd_path = self._call(self._simple, f"CWD {path}\n".encode())
+        return self.cwd_path
+
+    def size(self, name):
+        return int(self._call(self._simple, f"SIZE {name}\n".encode()))
+
+    def hash(self, name):
+        """Hex sha256 of a remote file."""
+        return self._call(self._simple, f"HASH {name}\n".encode())
+
+    def _check(self, remote, hasher, expected):
+        if hasher and hasher.hexdigest() != expected:
+            raise FTPError(f"{remote}: checksum mismatch")
+
+    def _get(self, remote, local, offset, length, compress):
+        start = time.monotonic()
+        ranged = offset or length is not None
+        hasher = hashlib.sha256() if self.verify and not ranged else None
+        if ranged:
+            self.sock.write(rest_request(offset, length))
+        self.sock.write(f"GET -z {remote}\n".encode() if compress else f"GET {remote}\n".encode())
+        if ranged:
+            self._reply()
+        header = self._reply()
+        try:
+            with open(local, 'r+b' if offset and os.path.exists(local) else 'wb') as f:
+                f.seek(offset)
+                if compress:
+                    try:
+                        size, _ = recv_compressed(self.sock, f, hasher)
+                    except ConnectionError:
+                        raise
+                    except (IOError, zlib.error) as e:
+                        if isinstance(e, OSError) and e.errno is not None:
+                            raise  # writing the local file failed: handled below
+                        raise FTPError(str(e))
+                else:
+                    size = int(header.split()[1])
+                    if recv_to_file(self.sock, f, size, hasher=hasher) < size:
+                        raise ConnectionError("connection lost")
+        except OSError as e:
+            if not isinstance(e, (ConnectionError, socket.timeout)):
+                # the local file failed with the reply body still on the socket:
+                # reconnect on the next call rather than read the rest as replies
+                self._drop()
+            raise
+        if hasher:
+            expected = reply_digest(header)
+            if expected is None:
+                # the server hashed the file while sending it, so this is a cache hit
+                self.sock.sendall(f"HASH {remote}\n".encode())
+                expected = self._payload(self._reply()).decode()
+            self._check(remote, hasher, expected)
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    def get(self, remote, local=None, offset=0, length=None, compress=False):
+        """Download remote (or length bytes of it from offset) into local at the same offset.
+
+        compress=True has the server send the data zlib-compressed.
+        """
+        local = local or os.path.basename(remote)
+        return self._call(self._get, remote, local, offset, length, compress)
+
+    def _put(self, local, remote, compress):
+        start = time.monotonic()
+        size = os.path.getsize(local)
+        hasher = hashlib.sha256() if self.verify else None
+        self.sock.write(f"PUT -z {remote}\n".encode() if compress else f"PUT {remote}\n".encode())
+        self._reply()
+        with open(local, 'rb') as f:
+            if compress:
+                send_compressed(self.sock, f, 0, size, hasher)
+            else:
+                self.sock.write(f"SIZE {size}\n".encode())
+                if hasher:
+                    send_hashed(self.sock, f, 0, size, hasher)
+                elif size:
+                    self.sock.sendfile(f, 0, size)
+        self._check(remote, hasher, reply_digest(self._reply()))
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    def _dput(self, local, remote):
+        start = time.monotonic()
+        self.sock.sendall(f"DPUT {remote}\n".encode())
+        block_size = int(self._reply().split()[2])
+        size = os.path.getsize(local)
+        hasher = hashlib.sha256() if self.verify else None
+        digests = file_digests(local, block_size, hasher)
+        self.sock.write(f"BLOCKS {size} {len(digests)}\n".encode())
+        self.sock.sendall(b''.join(digests))
+        missing = [int(i) for i in self._payload(self._reply()).split()]
+        with open(local, 'rb') as f:
+            send_blocks(self.sock, f, missing, block_size, size)
+        self._check(remote, hasher, reply_digest(self._reply()))
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    def put(self, local, remote=None, compress=False, delta=False):
+        """Upload local as remote (default: the same base name).
+
+        compress=True sends it zlib-compressed; delta=True sends only the
+        blocks the server does not already hold, falling back to a full
+        upload if the server cannot assemble the file.
+        """
+        remote = remote or os.path.basename(local)
+        if delta:
+            try:
+                return self._call(self._dput, local, remote)
+            except FTPError:
+                pass
+        return self._call(self._put, local, remote, compress)
+
+class ConnectionPool:
+    """Idle FTPClient connections kept per (host, port) for reuse.
+
+    Connections come back with their directory reset to '/'. A connection
+    idle longer than check_after seconds is probed with NOOP before reuse.
+    """
+
+    def __init__(self, max_idle=4, check_after=30.0, timeout=None):
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, port):
+        while True:
+            with self._lock:
+                idle = self._idle.get((host, port))
+                client = idle.pop() if idle else None
+            if client is None:
+                return FTPClient(host, port, self.timeout)
+            if time.monotonic() - client.last_used < self.check_after:
+                return client
+            try:
+                client.noop()
+                return client
+            except (OSError, FTPError):
+                client.close()
+
+    def release(self, client):
+        if client.sock is not None and client.cwd_path != '/':
+            try:
+                client.cwd('/')
+            except (OSError, FTPError):
+                client.close()
+        if client.sock is None:
+            return
+        with self._lock:
+            idle = self._idle.setdefault((client.host, client.port), [])
+            if len(idle) < self.max_idle:
+                idle.append(client)
+                return
+        client.close()
+
+    @contextmanager
+    def connection(self, host, port):
+        client = self.acquire(host, port)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def close(self):
+        with self._lock:
+            clients = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for client in clients:
+            client.close()
+
+class AsyncFTPClient:
+    """asyncio counterpart of FTPClient with the same methods as coroutines."""
+
+    def __init__(self, host='127.0.0.1', port=2121, verify=False):
+        self.host = host
+        self.port = port
+        self.verify = verify
+        self.reader = self.writer = None
+        self.cwd_path = '/'
+        self.last_used = time.monotonic()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        raw = self.writer.get_extra_info('socket')
+        if raw is not None:
+            raw.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if self.cwd_path != '/':
+            self.writer.write(f"CWD {self.cwd_path}\n".encode())
+            await self._payload(await self._reply())
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(b"QUIT\n")
+            await self.reader.readline()
+        except OSError:
+            pass
+        self._drop()
+
+    def _drop(self):
+        self.writer.close()
+        self.reader = self.writer = None
+
+    async def _reply(self):
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionError("connection lost")
+        line = line.decode().strip()
+        if not line.startswith("OK"):
+            raise FTPError(line)
+        return line
+
+    async def _payload(self, header):
+        try:
+            return await self.reader.readexactly(int(header.split()[1]))
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("connection lost")
+
+    async def _call(self, op, *args):
+        for attempt in (1, 2):
+            if self.writer is None:
+                await self.connect()
+            try:
+                result = await op(*args)
+                self.last_used = time.monotonic()
+                return result
+            except ConnectionError:
+                self._drop()
+                if attempt == 2:
+                    raise
+
+    async def _simple(self, request):
+        self.writer.write(request)
+        return (await self._payload(await self._reply())).decode()
+
+    async def _noop(self):
+        self.writer.write(b"NOOP\n")
+        await self._reply()
+
+    async def noop(self):
+        await self._call(self._noop)
+
+    async def _ls_chunked(self, request):
+        self.writer.write(request)
+        await self._reply()
+        try:
+            data = b''.join([chunk async for chunk in iter_chunks_async(self.reader)])
+        except IOError as e:
+            if isinstance(e, ConnectionError):
+                raise
+            raise FTPError(str(e))
+        return data.decode().splitlines()
+
+    async def ls(self, long=False, offset=0, limit=None):
+        if not long and not offset and limit is None:
+            return [name for name in (await self._call(self._simple, b"LS\n")).split('\n') if name]
+        lines = await self._call(self._ls_chunked, ls_request(long, offset, limit))
+        return [parse_mlsd(line) for line in lines] if long else lines
+
+    async def pwd(self):
+        return await self._call(self._simple, b"PWD\n")
+
+    async def stat(self):
+        return await self._call(self._simple, b"STAT\n")
+
+    async def cwd(self, path):
+        self.cwd_path = await self._call(self._simple, f"CWD {path}\n".encode())
+        return self.cwd_path
+
+    async def size(self, name):
+        return int(await self._call(self._simple, f"SIZE {name}\n".encode()))
+
+    async def hash(self, name):
+        return await self._call(self._simple, f"HASH {name}\n".encode())
+
+    _check = FTPClient._check
+
+    async def _get_compressed(self, f, hasher):
+        inflater = Inflater()
+        size = 0
+        try:
+            async for chunk in iter_chunks_async(self.reader):
+                for piece in inflater.feed(chunk):
+                    f.write(piece)
+                    if hasher:
+                        hasher.update(piece)
+                    size += len(piece)
+            tail = inflater.finish()
+        except ConnectionError:
+            raise
+        except (IOError, zlib.error) as e:
+            self._drop()  # the rest of a corrupt stream is still in flight
+            raise FTPError(str(e))
+        f.write(tail)
+        if hasher:
+            hasher.update(tail)
+        return size + len(tail)
+
+    async def _get(self, remote, local, offset, length, compress):
+        start = time.monotonic()
+        ranged = offset or length is not None
+        hasher = hashlib.sha256() if self.verify and not ranged else None
+        if ranged:
+            self.writer.write(rest_request(offset, length))
+        self.writer.write(f"GET -z {remote}\n".encode() if compress else f"GET {remote}\n".encode())
+        if ranged:
+            await self._reply()
+        header = await self._reply()
+        try:
+            with open(local, 'r+b' if offset and os.path.exists(local) else 'wb') as f:
+                f.seek(offset)
+                if compress:
+                    size = await self._get_compressed(f, hasher)
+                else:
+                    size = remaining = int(header.split()[1])
+                    while remaining:
+                        chunk = await self.reader.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise ConnectionError("connection lost")
+                        f.write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                        remaining -= len(chunk)
+        except OSError as e:
+            if not isinstance(e, ConnectionError):
+                # the local file failed with the reply body still on the socket:
+                # reconnect on the next call rather than read the rest as replies
+                self._drop()
+            raise
+        if hasher:
+            expected = reply_digest(header)
+            if expected is None:
+                # the server hashed the file while sending it, so this is a cache hit
+                self.writer.write(f"HASH {remote}\n".encode())
+                expected = (await self._payload(await self._reply())).decode()
+            self._check(remote, hasher, expected)
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    async def get(self, remote, local=None, offset=0, length=None, compress=False):
+        local = local or os.path.basename(remote)
+        return await self._call(self._get, remote, local, offset, length, compress)
+
+    async def _put(self, local, remote, compress):
+        start = time.monotonic()
+        size = os.path.getsize(local)
+        hasher = hashlib.sha256() if self.verify else None
+        self.writer.write(f"PUT -z {remote}\n".encode() if compress else f"PUT {remote}\n".encode())
+        await self._reply()
+        with open(local, 'rb') as f:
+            if compress:
+                self.writer.write(f"SIZE {CHUNKED}\n".encode())
+                for chunk in deflate_file(f, 0, size, CHUNK_SIZE, hasher=hasher):
+                    if chunk:
+                        self.writer.write(chunk_header(len(chunk)))
+                        self.writer.write(chunk)
+                        await self.writer.drain()
+                self.writer.write(chunk_header(0))
+            else:
+                self.writer.write(f"SIZE {size}\n".encode())
+                if hasher:
+                    remaining = size
+                    while remaining:
+                        chunk = f.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise IOError("local file shrank during upload")
+                        hasher.update(chunk)
+                        self.writer.write(chunk)
+                        await self.writer.drain()
+                        remaining -= len(chunk)
+                elif size:
+                    await asyncio.get_running_loop().sendfile(self.writer.transport, f, 0, size)
+        self._check(remote, hasher, reply_digest(await self._reply()))
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    async def _dput(self, local, remote):
+        start = time.monotonic()
+        self.writer.write(f"DPUT {remote}\n".encode())
+        block_size = int((await self._reply()).split()[2])
+        size = os.path.getsize(local)
+        hasher = hashlib.sha256() if self.verify else None
+        digests = file_digests(local, block_size, hasher)
+        self.writer.write(f"BLOCKS {size} {len(digests)}\n".encode())
+        self.writer.write(b''.join(digests))
+        missing = [int(i) for i in (await self._payload(await self._reply())).split()]
+        with open(local, 'rb') as f:
+            for first, count in missing_runs(missing):
+                offset = first * block_size
+                await asyncio.get_running_loop().sendfile(
+                    self.writer.transport, f, offset, min(count * block_size, size - offset))
+        self._check(remote, hasher, reply_digest(await self._reply()))
+        return TransferResult(remote, local, size, time.monotonic() - start)
+
+    async def put(self, local, remote=None, compress=False, delta=False):
+        remote = remote or os.path.basename(local)
+        if delta:
+            try:
+                return await self._call(self._dput, local, remote)
+            except FTPError:
+                pass
+        return await self._call(self._put, local, remote, compress)
+
+class AsyncConnectionPool:
+    """ConnectionPool for AsyncFTPClient; use from a single event loop."""
+
+    def __init__(self, max_idle=4, check_after=30.0):
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._idle = {}
+
+    async def acquire(self, host, port):
+        idle = self._idle.get((host, port))
+        while idle:
+            client = idle.pop()
+            if time.monotonic() - client.last_used < self.check_after:
+                return client
+            try:
+                await client.noop()
+                return client
+            except (OSError, FTPError):
+                await client.close()
+        return AsyncFTPClient(host, port)
+
+    async def release(self, client):
+        if client.writer is not None and client.cwd_path != '/':
+            try:
+                await client.cwd('/')
+            except (OSError, FTPError):
+                await client.close()
+        if client.writer is None:
+            return
+        idle = self._idle.setdefault((client.host, client.port), [])
+        if len(idle) < self.max_idle:
+            idle.append(client)
+        else:
+            await client.close()
+
+    @asynccontextmanager
+    async def connection(self, host, port):
+        client = await self.acquire(host, port)
+        try:
+            yield client
+        finally:
+            await self.release(client)
+
+    async def close(self):
+        clients = [c for idle in self._idle.values() for c in idle]
+        self._idle.clear()
+        for client in clients:
+            await client.close()
+
+def read_commands(script=None):
+    """Yield command lines from the prompt, or from a script file ('-' for stdin)."""
+    if script is None:
+        while True:
+            try:
+                yield input("ftp> ")
+            except EOFError:
+                return
+    else:
+        f = sys.stdin if script == '-' else open(script)
+        try:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    print("ftp>", line.strip())
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def interactive(host, port, connections=0, script=None, verify=False):
+    with BufferedSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
         s.connect((host, port))
         print(f"Connected to {host}:{port}")
         try:
-            while True:
-                line = input("ftp> ").strip()
+            for line in read_commands(script):
+                line = line.strip()
                 if not line:
                     continue
                 parts = line.split(maxsplit=1)
                 verb = parts[0].upper()
                 arg = parts[1] if len(parts) > 1 else ''
                 if verb == 'LS':
-                    cmd_list(s)
+                    cmd_list(s, arg)
                 elif verb == 'GET':
+                    compress, arg = split_flag(arg, '-z')
+                    if not arg:
+                        print("Usage: GET [-z] <filename>")
+                        continue
+                    cmd_get(s, arg, compress=compress, verify=verify)
+                elif verb == 'REGET':
+                    if not arg:
+                        print("Usage: REGET <filename>")
+                        continue
+                    cmd_get(s, arg, resume=True, verify=verify)
+                elif verb == 'PGET':
+                    if not arg:
+                        print("Usage: PGET <filename>")
+                        continue
+                    cmd_pget(s, host, port, arg, connections)
+                elif verb == 'MGET':
                     if not arg:
-                        print("Usage: GET <filename>")
+                        print("Usage: MGET <pattern>")
                         continue
-                    cmd_get(s, arg)
+                    cmd_mget(s, arg)
                 elif verb == 'PUT':
+                    compress, arg = split_flag(arg, '-z')
+                    if not arg:
+                        print("Usage: PUT [-z] <filename>")
+                        continue
+                    cmd_put(s, arg, compress=compress, verify=verify)
+                elif verb == 'REPUT':
+                    if not arg:
+                        print("Usage: REPUT <filename>")
+                        continue
+                    cmd_put(s, arg, resume=True, verify=verify)
+                elif verb == 'DPUT':
+                    if not arg:
+                        print("Usage: DPUT <filename>")
+                        continue
+                    cmd_dput(s, arg, verify)
+                elif verb == 'MPUT':
                     if not arg:
-                        print("Usage: PUT <filename>")
+                        print("Usage: MPUT <glob>")
                         continue
-                    cmd_put(s, arg)
+                    cmd_mput(s, arg)
+                elif verb == 'SIZE':
+                    cmd_size(s, arg)
+                elif verb == 'HASH':
+                    cmd_hash(s, arg)
                 elif verb == 'PWD':
                     cmd_pwd(s)
                 elif verb == 'CWD':
                     cmd_cwd(s, arg)
+                elif verb == 'STAT':
+                    cmd_stat(s)
                 elif verb == 'QUIT':
-                    s.sendall(b"QUIT\n")
-                    header = recv_line(s)
-                    if header:
-                        print(header)
-                    print("Closing connection.")
-                    return
+                    break
                 else:
-                    print("Unknown command. Available: LS, GET <file>, PUT <file>, PWD, CWD <dir>, QUIT")
+                    print("Unknown command. Available: LS [-l] [<offset> <limit>], GET [-z] <file>, REGET <file>, PGET <file>, MGET <pattern>, "
+                          "PUT [-z] <file>, REPUT <file>, DPUT <file>, MPUT <glob>, SIZE <file>, HASH <file>, PWD, CWD <dir>, STAT, QUIT")
+            # QUIT, or end of input
+            s.sendall(b"QUIT\n")
+            header = recv_line(s)
+            if header:
+                print(header)
+            print("Closing connection.")
         except KeyboardInterrupt:
             print("\nInterrupted. Sending QUIT.")
             try:
@@ -170,5 +1318,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Simple FTP-like client with PWD/CWD")
     parser.add_argument('--host', '-H', default='127.0.0.1', help='Server host (default localhost)')
     parser.add_argument('--port', '-p', type=int, default=2121, help='Server port (default 2121)')
+    parser.add_argument('--connections', '-n', type=int, default=0,
+                        help='Connections per PGET download, 0 to size automatically (default 0)')
+    parser.add_argument('--script', '-s', metavar='FILE',
+                        help="Run commands from FILE ('-' for stdin) instead of prompting")
+    parser.add_argument('--verify', action='store_true',
+                        help='Check the sha256 of every GET/PUT against the server while streaming; '
+                             'a GET whose reply lacks the digest asks with HASH, which the server '
+                             'answers from the digest it took while sending the file')
     args = parser.parse_args()
-    interactive(args.host, args.port)
+    interactive(args.host, args.port, args.connections, args.script, args.verify)
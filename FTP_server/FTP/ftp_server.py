@@ -1,19 +1,52 @@
 import socket
+import stat
 import threading
+import asyncio
 import os
 import argparse
 import pathlib
+import secrets
+import time
+import itertools
+import zlib
+import hashlib
+import functools
+import signal
+import sys
+from protocol import (BufferedSocket, CountingReader, CountingWriter, CHUNKED, chunk_header,
+                      iter_chunks, iter_chunks_async, split_flag, deflate_file, Inflater, ZLIB_LEVEL)
+from caches import ListingCache, CompressedCache, DigestCache, FileCache, PathCache
+from blockindex import BlockIndex, default_index_path
+from metrics import Metrics, serve_http
+from ratelimit import TokenBucket, Shaper, SHAPE_CHUNK, parse_rate
+from workers import Supervisor
 
 HOST = '0.0.0.0'
-
-def recvall(conn, n):
-    data = b''
-    while len(data) < n:
-        packet = conn.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
+DEFAULT_BACKLOG = 128
+CHUNK_SIZE = 1024 * 1024  # bytes per read when copying through userspace
+USE_SENDFILE = True       # zero-copy GET via os.sendfile where available
+LISTING_CACHE = ListingCache()  # LS payloads shared by all sessions
+LIST_CHUNK = 64 * 1024          # bytes per chunk of a streamed listing
+COMPRESS_CACHE = CompressedCache()  # zlib bodies of popular files for GET -z
+COMPRESS_LEVEL = ZLIB_LEVEL
+DIGEST_CACHE = DigestCache()    # sha256 of whole files for HASH and GET headers
+FILE_CACHE = FileCache()        # contents of hot files for GET
+PATH_CACHE = PathCache()        # resolved CWD targets and their PWD payloads
+GLOBAL_BUCKET = None            # TokenBucket shared by every transfer (--rate-limit)
+CONN_RATE = 0                   # bytes/s allowed per connection, 0 = unlimited
+REUSE_PORT = False              # set in --workers mode so every worker can bind the port
+METRICS = Metrics()             # counters reported by STAT and --metrics-port
+METRICS.add_source('listing_cache', LISTING_CACHE.stats)
+METRICS.add_source('compress_cache', COMPRESS_CACHE.stats)
+METRICS.add_source('digest_cache', DIGEST_CACHE.stats)
+METRICS.add_source('file_cache', FILE_CACHE.stats)
+METRICS.add_source('path_cache', PATH_CACHE.stats)
+VERBS = ('LS', 'GET', 'PUT', 'DPUT', 'REST', 'SIZE', 'HASH', 'PWD', 'CWD', 'NOOP', 'STAT', 'QUIT')
+DIGEST_SIZE = 32        # sha256 digests in a DPUT block list
+MAX_BLOCKS = 1 << 20    # longest block list a DPUT may announce
+BLOCK_INDEXES = {}      # base_dir -> BlockIndex used by DPUT
+INDEX_PATH = None       # where the block index is saved (--index-path), None = next to the served dir
+_block_index_lock = threading.Lock()
 
 def safe_within_base(base_dir, path):
     # Ensure path is inside base_dir
@@ -21,20 +54,676 @@ def safe_within_base(base_dir, path):
     path = os.path.abspath(path)
     return os.path.commonpath([base_dir]) == os.path.commonpath([base_dir, path])
 
+def pwd_payload(base_dir, current_dir):
+    # represent current_dir as path relative to base_dir, leading '/'
+    base_abs = os.path.abspath(base_dir)
+    cur_abs = os.path.abspath(current_dir)
+    rel = os.path.relpath(cur_abs, base_abs)
+    rel_path = '/' if rel == '.' else '/' + rel.replace('\\', '/')
+    return rel_path.encode()
+
+def cwd_target(base_dir, current_dir, arg):
+    """Return (candidate, inside base_dir, PWD payload) for a CWD argument, touching no files."""
+    # If arg starts with '/', treat it as relative to base_dir root
+    if arg.startswith('/') or arg.startswith('\\'):
+        candidate = os.path.join(base_dir, arg.lstrip('/\\'))
+    else:
+        candidate = os.path.join(current_dir, arg)
+    candidate = os.path.abspath(candidate)
+    inside = safe_within_base(base_dir, candidate)
+    return candidate, inside, pwd_payload(base_dir, candidate) if inside else None
+
+def resolve_cwd(base_dir, current_dir, arg):
+    """Return (new_dir, its PWD payload, None) on success or (None, None, error_response)."""
+    candidate, inside, payload = PATH_CACHE.get((base_dir, current_dir, arg),
+                                                lambda: cwd_target(base_dir, current_dir, arg))
+    # Verify candidate is a directory and inside base_dir
+    try:
+        is_dir = stat.S_ISDIR(os.stat(candidate).st_mode)
+    except (OSError, ValueError):
+        is_dir = False
+    if not is_dir:
+        return None, None, b"ERR not a directory\n"
+    if not inside:
+        return None, None, b"ERR access denied\n"
+    return candidate, payload, None
+
+def file_stat(path):
+    """os.stat of path if it is a regular file, else None; one call instead of exists/isfile/getsize."""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+async def run_blocking(func, *args):
+    """Run blocking disk work in the default executor so the event loop keeps serving other sessions."""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+def send_file(conn, f, offset, count, shaper=None, hasher=None):
+    """Send count bytes of f from offset, zero-copy when the OS allows it.
+
+    hasher, if given, is updated with the data, which then has to be copied.
+    """
+    if count <= 0:
+        return 0
+    if shaper:
+        # one SHAPE_CHUNK per grant, so shaped transfers interleave
+        sent = 0
+        while sent < count:
+            n = min(SHAPE_CHUNK, count - sent)
+            shaper.wait(n)
+            k = send_file(conn, f, offset + sent, n, hasher=hasher)
+            if not k:
+                break
+            sent += k
+        return sent
+    if USE_SENDFILE and hasattr(os, 'sendfile') and not hasher:
+        return conn.sendfile(f, offset, count)
+    # fallback: copy through one reusable buffer
+    f.seek(offset)
+    buf = bytearray(min(CHUNK_SIZE, count))
+    sent = 0
+    with memoryview(buf) as view:
+        while sent < count:
+            n = f.readinto(view[:min(len(buf), count - sent)])
+            if not n:
+                break
+            if hasher:
+                hasher.update(view[:n])
+            conn.sendall(view[:n])
+            sent += n
+    return sent
+
+def send_body(conn, body, offset, count, shaper=None, hasher=None):
+    """Send count bytes from offset of a file body held in memory by FILE_CACHE."""
+    step = SHAPE_CHUNK if shaper else CHUNK_SIZE
+    with memoryview(body) as view:
+        for start in range(offset, offset + count, step):
+            piece = view[start:min(start + step, offset + count)]
+            if shaper:
+                shaper.wait(len(piece))
+            if hasher:
+                hasher.update(piece)
+            conn.sendall(piece)
+
+async def send_body_async(writer, body, offset, count, shaper=None, hasher=None):
+    step = SHAPE_CHUNK if shaper else CHUNK_SIZE
+    view = memoryview(body)
+    for start in range(offset, offset + count, step):
+        piece = view[start:min(start + step, offset + count)]
+        if shaper:
+            await shaper.wait_async(len(piece))
+        if hasher:
+            hasher.update(piece)
+        writer.write(piece)
+        await writer.drain()
+
+async def send_file_async(writer, f, offset, count, shaper=None, hasher=None):
+    if count <= 0:
+        return 0
+    if shaper:
+        sent = 0
+        while sent < count:
+            n = min(SHAPE_CHUNK, count - sent)
+            await shaper.wait_async(n)
+            k = await send_file_async(writer, f, offset + sent, n, hasher=hasher)
+            if not k:
+                break
+            sent += k
+        return sent
+    if USE_SENDFILE and not hasher:
+        return await writer.sendfile(f, offset, count)
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        chunk = f.read(min(CHUNK_SIZE, count - sent))
+        if not chunk:
+            break
+        if hasher:
+            hasher.update(chunk)
+        writer.write(chunk)
+        await writer.drain()
+        sent += len(chunk)
+    return sent
+
+def parse_ls_args(arg):
+    """Parse 'LS [-l] [<offset> [<limit>]]' into (long, offset, limit)."""
+    parts = arg.split()
+    long = bool(parts) and parts[0] == '-l'
+    if long:
+        parts = parts[1:]
+    if len(parts) > 2:
+        raise ValueError("usage: LS [-l] [<offset> [<limit>]]")
+    offset = int(parts[0]) if parts else 0
+    limit = int(parts[1]) if len(parts) > 1 else None
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must be >= 0")
+    return long, offset, limit
+
+def mlsd_line(entry):
+    # MLSD-style facts; DirEntry caches its stat (free on Windows) and is_dir() uses d_type
+    st = entry.stat()
+    kind = 'dir' if entry.is_dir() else 'file'
+    modify = time.strftime('%Y%m%d%H%M%S', time.gmtime(st.st_mtime))
+    return f"type={kind};size={st.st_size};modify={modify}; {entry.name}"
+
+def listing_chunks(path, long, offset, limit):
+    """Yield the listing of path as encoded chunks of about LIST_CHUNK bytes.
+
+    Entries come straight from os.scandir in directory order, one line each,
+    so memory is bounded by the chunk size whatever the directory holds.
+    Pages (offset/limit) are stable while the directory is unchanged.
+    """
+    lines = []
+    size = 0
+    with os.scandir(path) as it:
+        stop = None if limit is None else offset + limit
+        for entry in itertools.islice(it, offset, stop):
+            try:
+                line = ((mlsd_line(entry) if long else entry.name) + '\n').encode()
+            except OSError:
+                continue  # removed while we were listing
+            lines.append(line)
+            size += len(line)
+            if size >= LIST_CHUNK:
+                yield b''.join(lines)
+                lines = []
+                size = 0
+    if lines:
+        yield b''.join(lines)
+
+def send_chunked(conn, chunks, shaper=None):
+    """Send an OK CHUNKED reply; an OSError from chunks ends it with an ERR line."""
+    conn.write(f"OK {CHUNKED}\n".encode())
+    try:
+        for chunk in chunks:
+            if chunk:
+                if shaper:
+                    shaper.wait(len(chunk))
+                conn.write(chunk_header(len(chunk)))
+                conn.write(chunk)
+    except OSError as e:
+        conn.write(f"ERR {str(e)}\n".encode())
+        return
+    conn.write(chunk_header(0))
+
+async def send_chunked_async(writer, chunks, shaper=None):
+    writer.write(f"OK {CHUNKED}\n".encode())
+    chunks = iter(chunks)
+    try:
+        # producing a chunk reads the disk (listings, deflate): do it off the event loop
+        while (chunk := await run_blocking(next, chunks, None)) is not None:
+            if chunk:
+                if shaper:
+                    await shaper.wait_async(len(chunk))
+                writer.write(chunk_header(len(chunk)))
+                writer.write(chunk)
+                await writer.drain()
+    except OSError as e:
+        writer.write(f"ERR {str(e)}\n".encode())
+        return
+    writer.write(chunk_header(0))
+
+def send_listing(conn, path, arg):
+    """LS reply: cached one-shot payload for a bare LS, chunked stream otherwise."""
+    if not arg:
+        payload_bytes = LISTING_CACHE.listing(path)
+        conn.write(f"OK {len(payload_bytes)}\n".encode())
+        conn.write(payload_bytes)
+        return
+    long, offset, limit = parse_ls_args(arg)
+    chunks = listing_chunks(path, long, offset, limit)
+    first = next(chunks, b'')  # surface a bad directory as a plain ERR reply
+    send_chunked(conn, itertools.chain([first], chunks))
+
+async def send_listing_async(writer, path, arg):
+    if not arg:
+        payload_bytes = await run_blocking(LISTING_CACHE.listing, path)
+        writer.write(f"OK {len(payload_bytes)}\n".encode())
+        writer.write(payload_bytes)
+        return
+    long, offset, limit = parse_ls_args(arg)
+    chunks = listing_chunks(path, long, offset, limit)
+    first = await run_blocking(next, chunks, b'')
+    await send_chunked_async(writer, itertools.chain([first], chunks))
+
+def compressed_chunks(path, f, st, offset, count):
+    """zlib stream for a GET -z of count bytes of f; whole popular files come from COMPRESS_CACHE."""
+    if offset == 0 and count == st.st_size:
+        build = lambda: learning_digest(path, f, st, count)
+        cached = COMPRESS_CACHE.get(path, st, build)
+        if cached is not None:
+            return cached
+        return build()
+    return deflate_file(f, offset, count, CHUNK_SIZE, COMPRESS_LEVEL)
+
+def learning_digest(path, f, st, count):
+    # deflate a whole file, filling DIGEST_CACHE from the data on the way if it misses
+    hasher = DIGEST_CACHE.hasher(st) if DIGEST_CACHE.peek(path, st) is None else None
+    yield from deflate_file(f, 0, count, CHUNK_SIZE, COMPRESS_LEVEL, hasher)
+    if hasher:
+        DIGEST_CACHE.learn(path, st, hasher.hexdigest(), f)
+
+def parse_rest(arg):
+    """Parse 'REST <offset> [<length>]' arguments into (offset, length or None)."""
+    parts = arg.split()
+    if not 1 <= len(parts) <= 2:
+        raise ValueError("usage: REST <offset> [<length>]")
+    offset = int(parts[0])
+    length = int(parts[1]) if len(parts) > 1 else None
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("offset and length must be >= 0")
+    return offset, length
+
+def get_range(rest, size):
+    """Return (offset, count) to send for a GET of a size-byte file after REST."""
+    if not rest:
+        return 0, size
+    offset, length = rest
+    if offset > size:
+        raise ValueError("offset beyond end of file")
+    count = size - offset
+    if length is not None:
+        count = min(count, length)
+    return offset, count
+
+def parse_size_header(line, compress=False):
+    """Byte count from the 'SIZE <n>' line after PUT; PUT -z sends 'SIZE CHUNKED' (None)."""
+    value = line.split()[1]
+    if compress:
+        if value != CHUNKED:
+            raise ValueError("PUT -z expects SIZE CHUNKED")
+        return None
+    size = int(value)
+    if size < 0:
+        raise ValueError(size)
+    return size
+
+def get_header(count, digest):
+    # a whole-file GET carries the file's sha256 when it is already known
+    return (f"OK {count} sha256={digest}\n" if digest else f"OK {count}\n").encode()
+
+def get_digest(path, st, rest):
+    """(digest, hasher) for a GET: the cached sha256 of a whole file, or else a
+    hasher to learn it from the data as it is sent; both None for a range."""
+    if rest:
+        return None, None
+    digest = DIGEST_CACHE.peek(path, st)
+    return digest, None if digest else DIGEST_CACHE.hasher(st)
+
+def partial_path(path):
+    # where an interrupted upload of path is kept for REST + PUT to resume
+    return path + '.part'
+
+def check_resume(path, rest):
+    """Return an ERR response if a PUT after REST cannot resume, else None."""
+    if not rest or not rest[0]:
+        return None
+    try:
+        have = os.path.getsize(partial_path(path))
+    except OSError:
+        return b"ERR no partial upload to resume\n"
+    if have < rest[0]:
+        return f"ERR partial upload has only {have} bytes\n".encode()
+    return None
+
+class Upload:
+    """Receives a PUT into a temp file that replaces the target on commit.
+
+    Write errors are remembered rather than raised, so the caller can keep
+    draining the announced number of bytes and the stream stays in sync.
+    A fresh upload goes to a hidden .<name>.<rand>.part file; if the client
+    drops, abort(keep=True) leaves what arrived in <name>.part, and an upload
+    with offset > 0 (after REST) continues that file from offset.
+
+    The data is hashed as it is written; commit() records the sha256 in
+    DIGEST_CACHE and in self.digest.
+    """
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.error = None
+        self.f = None
+        self.hash = hashlib.sha256()
+        self.digest = None
+        try:
+            if offset:
+                self.tmp = partial_path(path)
+                self.f = open(self.tmp, 'r+b')
+                self.f.truncate(offset)
+                # the resumed file's digest covers the bytes already there
+                while self.f.tell() < offset:
+                    data = self.f.read(min(CHUNK_SIZE, offset - self.f.tell()))
+                    if not data:
+                        break
+                    self.hash.update(data)
+                self.f.seek(offset)
+            else:
+                self.tmp = os.path.join(os.path.dirname(path),
+                                        f".{os.path.basename(path)}.{secrets.token_hex(4)}.part")
+                fd = os.open(self.tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+                self.f = os.fdopen(fd, 'wb')
+        except OSError as e:
+            self.error = e
+
+    def write(self, data):
+        if self.error is None:
+            try:
+                self.f.write(data)
+            except OSError as e:
+                self.error = e
+            self.hash.update(data)
+
+    def _close(self):
+        if self.f:
+            try:
+                self.f.close()
+            except OSError as e:
+                self.error = self.error or e
+            self.f = None
+
+    def commit(self):
+        """Move the upload into place, or raise the first error seen."""
+        self._close()
+        if self.error is None:
+            try:
+                os.replace(self.tmp, self.path)
+                discard_indexed(self.path)
+                self.digest = self.hash.hexdigest()
+                DIGEST_CACHE.store(self.path, os.stat(self.path), self.digest)
+                return
+            except OSError as e:
+                self.error = e
+        self.abort()
+        raise self.error
+
+    def abort(self, keep=False):
+        """Drop the upload; keep=True saves the received bytes for a later resume."""
+        self._close()
+        try:
+            if keep and self.error is None:
+                os.replace(self.tmp, partial_path(self.path))
+            else:
+                os.unlink(self.tmp)
+        except OSError:
+            pass
+
+def recv_to_file(conn, path, size, offset=0, shaper=None):
+    """Stream size bytes from conn into path, holding at most CHUNK_SIZE in memory.
+
+    Returns the file's sha256, or None if the connection dropped; raises
+    OSError if the file could not be written. A shaper slows the reads down,
+    which TCP turns into backpressure on the sender.
+    """
+    upload = Upload(path, offset)
+    buf = bytearray(min(SHAPE_CHUNK if shaper else CHUNK_SIZE, size) or 1)
+    remaining = size
+    with memoryview(buf) as view:
+        while remaining:
+            n = conn.readinto(view[:min(len(buf), remaining)])
+            if not n:
+                upload.abort(keep=True)
+                return None
+            upload.write(view[:n])
+            remaining -= n
+            if shaper:
+                shaper.wait(n)
+    upload.commit()
+    return upload.digest
+
+async def recv_to_file_async(reader, path, size, offset=0, shaper=None):
+    # opening, writing and renaming the upload all touch the disk: keep them off the event loop
+    upload = await run_blocking(Upload, path, offset)
+    remaining = size
+    while remaining:
+        chunk = await reader.read(min(SHAPE_CHUNK if shaper else CHUNK_SIZE, remaining))
+        if not chunk:
+            await run_blocking(upload.abort, True)
+            return None
+        await run_blocking(upload.write, chunk)
+        remaining -= len(chunk)
+        if shaper:
+            await shaper.wait_async(len(chunk))
+    await run_blocking(upload.commit)
+    return upload.digest
+
+def inflate_into(upload, inflater, chunk):
+    # corrupt data fails the upload, but the caller keeps draining the stream
+    if upload.error is None:
+        try:
+            for piece in inflater.feed(chunk):
+                upload.write(piece)
+        except zlib.error as e:
+            upload.error = OSError(f"bad compressed data: {e}")
+
+def finish_inflate(upload, inflater):
+    if upload.error is None:
+        try:
+            upload.write(inflater.finish())
+        except zlib.error as e:
+            upload.error = OSError(f"bad compressed data: {e}")
+    upload.commit()
+
+def recv_compressed(conn, path, offset=0, shaper=None):
+    """Receive a PUT -z body (a chunked zlib stream) into path; same contract as recv_to_file."""
+    upload = Upload(path, offset)
+    inflater = Inflater()
+    try:
+        for chunk in iter_chunks(conn):
+            inflate_into(upload, inflater, chunk)
+            if shaper:
+                shaper.wait(len(chunk))
+    except ConnectionError:
+        upload.abort(keep=True)
+        return None
+    except Exception:
+        upload.abort()
+        raise
+    finish_inflate(upload, inflater)
+    return upload.digest
+
+async def recv_compressed_async(reader, path, offset=0, shaper=None):
+    upload = await run_blocking(Upload, path, offset)
+    inflater = Inflater()
+    try:
+        async for chunk in iter_chunks_async(reader):
+            await run_blocking(inflate_into, upload, inflater, chunk)
+            if shaper:
+                await shaper.wait_async(len(chunk))
+    except ConnectionError:
+        await run_blocking(upload.abort, True)
+        return None
+    except Exception:
+        await run_blocking(upload.abort)
+        raise
+    await run_blocking(finish_inflate, upload, inflater)
+    return upload.digest
+
+def block_index(base_dir):
+    with _block_index_lock:
+        index = BLOCK_INDEXES.get(base_dir)
+        if index is None:
+            index = BLOCK_INDEXES[base_dir] = BlockIndex(base_dir, index_path=INDEX_PATH)
+        return index
+
+def discard_indexed(path):
+    # path was just replaced: its old blocks must not be offered to a DPUT
+    with _block_index_lock:
+        indexes = list(BLOCK_INDEXES.values())
+    for index in indexes:
+        index.discard(path)
+
+def save_block_indexes():
+    # saves are rate-limited while serving; write out the last changes on the way down
+    with _block_index_lock:
+        indexes = list(BLOCK_INDEXES.values())
+    for index in indexes:
+        index.save(force=True)
+
+def exit_on_sigterm():
+    # turn SIGTERM into SystemExit so shutdown still runs finally blocks
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+def parse_blocks_header(line, block_size):
+    """Parse the 'BLOCKS <size> <count>' line after DPUT into (size, count)."""
+    parts = line.split()
+    if len(parts) != 3 or parts[0] != 'BLOCKS':
+        raise ValueError("expected BLOCKS <size> <count>")
+    size, count = int(parts[1]), int(parts[2])
+    if size < 0 or count != -(-size // block_size) or count > MAX_BLOCKS:
+        raise ValueError("bad BLOCKS header")
+    return size, count
+
+def split_digests(data):
+    return [bytes(data[i:i + DIGEST_SIZE]) for i in range(0, len(data), DIGEST_SIZE)]
+
+class DeltaUpload(Upload):
+    """A DPUT: blocks found in the block index are copied locally, the rest
+    are sent by the client. Every block is checked against its digest."""
+
+    def __init__(self, path, size, digests, sources, block_size):
+        super().__init__(path)
+        self.size = size
+        self.digests = digests
+        self.sources = sources  # (path, offset) of a local copy of each block, or None
+        self.block_size = block_size
+        self._fds = {}
+
+    def missing(self):
+        return [i for i, source in enumerate(self.sources) if source is None]
+
+    def block_len(self, i):
+        return min(self.block_size, self.size - i * self.block_size)
+
+    def _read(self, path, offset, n):
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = self._fds[path] = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return os.pread(fd, n, offset)
+
+    def check_sources(self):
+        """Ask the client for every local block that is unreadable or no longer matches.
+
+        Runs before the missing list is sent, so a stale index costs a few
+        extra blocks instead of the whole DPUT. Returns the files those
+        blocks came from.
+        """
+        stale = set()
+        for i, source in enumerate(self.sources):
+            if source is None:
+                continue
+            try:
+                ok = hashlib.sha256(self._read(*source, self.block_len(i))).digest() == self.digests[i]
+            except OSError:
+                ok = False
+            if not ok:
+                self.sources[i] = None
+                stale.add(source[0])
+        return stale
+
+    def put_block(self, i, data):
+        if self.error is None and hashlib.sha256(data).digest() != self.digests[i]:
+            self.error = OSError(f"block {i} does not match its digest")
+        self.write(data)
+
+    def copy_block(self, i):
+        if self.error is not None:
+            return
+        try:
+            data = self._read(*self.sources[i], self.block_len(i))
+        except OSError as e:
+            self.error = e
+            return
+        self.put_block(i, data)
+
+def prepare_delta(path, size, digests, index):
+    """DeltaUpload for a DPUT; files whose indexed blocks went stale are dropped from the index."""
+    upload = DeltaUpload(path, size, digests, index.lookup(digests), index.block_size)
+    for stale in upload.check_sources():
+        index.discard(stale)
+    return upload
+
+    def _close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        super()._close()
+
+def recv_delta(conn, upload, index, shaper=None):
+    """Assemble a DPUT from local blocks and the missing ones read from conn.
+
+    Returns the file's sha256, or None if the connection dropped; raises
+    OSError if the file could not be assembled (the client should then fall
+    back to a plain PUT).
+    """
+    for i, source in enumerate(upload.sources):
+        if source is None:
+            data = conn.readexactly(upload.block_len(i))
+            if data is None:
+                upload.abort()
+                return None
+            upload.put_block(i, data)
+            if shaper:
+                shaper.wait(len(data))
+        else:
+            upload.copy_block(i)
+    upload.commit()
+    index.add(upload.path, upload.digests)
+    return upload.digest
+
+async def recv_delta_async(reader, upload, index, shaper=None):
+    for i, source in enumerate(upload.sources):
+        if source is None:
+            try:
+                data = await reader.readexactly(upload.block_len(i))
+            except asyncio.IncompleteReadError:
+                await run_blocking(upload.abort)
+                return None
+            await run_blocking(upload.put_block, i, data)
+            if shaper:
+                await shaper.wait_async(len(data))
+        else:
+            await run_blocking(upload.copy_block, i)
+    await run_blocking(upload.commit)
+    await run_blocking(index.add, upload.path, upload.digests)
+    return upload.digest
+
+class ConnectionLimit:
+    """Counts live sessions and refuses new ones above max_conns (0 = unlimited)."""
+
+    def __init__(self, max_conns=0):
+        self.max_conns = max_conns
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.max_conns and self.active >= self.max_conns:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
 def handle_client(conn, addr, base_dir):
     print(f"[+] Connection from {addr}")
     current_dir = os.path.abspath(base_dir)  # per-connection cwd
+    current_pwd = pwd_payload(base_dir, current_dir)  # its PWD reply, kept in step by CWD
+    pending_rest = None  # (offset, length) from REST, applies to the next command only
+    shaper = Shaper(GLOBAL_BUCKET, CONN_RATE)  # throttles GET/PUT data only
+    conn = BufferedSocket(conn)
+    seen_in = seen_out = 0  # byte counters already charged to earlier commands
     try:
         with conn:
             while True:
                 # Read a command line (terminated by \n)
-                cmd_line = b''
-                while not cmd_line.endswith(b'\n'):
-                    chunk = conn.recv(1)
-                    if not chunk:
-                        print(f"[-] {addr} disconnected")
-                        return
-                    cmd_line += chunk
+                cmd_line = conn.readline()
+                if cmd_line is None:
+                    print(f"[-] {addr} disconnected")
+                    return
                 cmd = cmd_line.decode().strip()
                 if not cmd:
                     continue
@@ -42,146 +731,595 @@ def handle_client(conn, addr, base_dir):
                 parts = cmd.split(maxsplit=1)
                 verb = parts[0].upper()
                 arg = parts[1] if len(parts) > 1 else ''
+                rest, pending_rest = pending_rest, None
+
+                # time the command and charge it the bytes moved since the previous one
+                started = time.perf_counter()
+                try:
+                    if verb == 'LS':
+                        try:
+                            send_listing(conn, current_dir, arg)
+                        except Exception as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+
+                    elif verb == 'GET':
+                        compress, arg = split_flag(arg, '-z')
+                        if not arg:
+                            conn.write(b"ERR missing filename\n")
+                            continue
+                        safe_name = os.path.basename(arg)
+                        path = os.path.join(current_dir, safe_name)
+                        st = file_stat(path)
+                        if st is None:
+                            conn.write(b"ERR file not found\n")
+                            continue
+                        try:
+                            body = None if compress else FILE_CACHE.get(path, st)
+                            if body is not None:
+                                offset, count = get_range(rest, st.st_size)
+                                digest, hasher = get_digest(path, st, rest)
+                                conn.write(get_header(count, digest))
+                                send_body(conn, body, offset, count, shaper, hasher)
+                                if hasher:
+                                    DIGEST_CACHE.learn(path, st, hasher.hexdigest())
+                                continue
+                            with open(path, 'rb') as f:
+                                st = os.fstat(f.fileno())
+                                offset, count = get_range(rest, st.st_size)
+                                if compress:
+                                    send_chunked(conn, compressed_chunks(path, f, st, offset, count), shaper)
+                                else:
+                                    digest, hasher = get_digest(path, st, rest)
+                                    conn.write(get_header(count, digest))
+                                    if send_file(conn, f, offset, count, shaper, hasher) == count and hasher:
+                                        DIGEST_CACHE.learn(path, st, hasher.hexdigest(), f)
+                        except Exception as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
 
+                    elif verb == 'PUT':
+                        compress, arg = split_flag(arg, '-z')
+                        if not arg:
+                            conn.write(b"ERR missing filename\n")
+                            continue
+                        safe_name = os.path.basename(arg)
+                        path = os.path.join(current_dir, safe_name)
+                        err = check_resume(path, rest)
+                        if err:
+                            conn.write(err)
+                            continue
+                        conn.write(b"OK ready for size\n")
+                        # read header line for SIZE
+                        header_line = conn.readline()
+                        if header_line is None:
+                            conn.write(b"ERR connection lost\n")
+                            return
+                        header_line = header_line.decode().strip()
+                        if not header_line.startswith('SIZE '):
+                            conn.write(b"ERR expected SIZE header\n")
+                            continue
+                        try:
+                            size = parse_size_header(header_line, compress)
+                        except ValueError:
+                            conn.write(b"ERR bad size\n")
+                            continue
+                        try:
+                            offset = rest[0] if rest else 0
+                            if compress:
+                                digest = recv_compressed(conn, path, offset, shaper)
+                            else:
+                                digest = recv_to_file(conn, path, size, offset, shaper)
+                            if digest is None:
+                                print(f"[-] {addr} disconnected during upload")
+                                return
+                        except OSError as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+                            continue
+                        conn.write(f"OK uploaded sha256={digest}\n".encode())
+
+                    elif verb == 'DPUT':
+                        # delta upload: only blocks missing from the block index are sent
+                        if not arg:
+                            conn.write(b"ERR missing filename\n")
+                            continue
+                        path = os.path.join(current_dir, os.path.basename(arg))
+                        index = block_index(base_dir)
+                        conn.write(f"OK blocks {index.block_size}\n".encode())
+                        header_line = conn.readline()
+                        if header_line is None:
+                            return
+                        try:
+                            size, count = parse_blocks_header(header_line.decode(), index.block_size)
+                        except ValueError as e:
+                            # the digest list that follows cannot be skipped
+                            conn.write(f"ERR {str(e)}\n".encode())
+                            return
+                        digests = conn.readexactly(count * DIGEST_SIZE)
+                        if digests is None:
+                            return
+                        digests = split_digests(digests)
+                        try:
+                            index.refresh_dir(current_dir)
+                        except OSError:
+                            pass
+                        upload = prepare_delta(path, size, digests, index)
+                        missing = upload.missing()
+                        payload_bytes = ' '.join(map(str, missing)).encode()
+                        conn.write(f"OK {len(payload_bytes)}\n".encode())
+                        conn.write(payload_bytes)
+                        try:
+                            digest = recv_delta(conn, upload, index, shaper)
+                            if digest is None:
+                                print(f"[-] {addr} disconnected during upload")
+                                return
+                        except OSError as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+                            continue
+                        conn.write(f"OK uploaded sha256={digest} ({len(missing)} of {count} blocks sent)\n".encode())
+
+                    elif verb == 'REST':
+                        # restart marker for the next GET/PUT: offset and optional byte count
+                        try:
+                            pending_rest = parse_rest(arg)
+                        except ValueError as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+                            continue
+                        conn.write(f"OK restarting at {pending_rest[0]}\n".encode())
+
+                    elif verb == 'SIZE':
+                        if not arg:
+                            conn.write(b"ERR missing filename\n")
+                            continue
+                        st = file_stat(os.path.join(current_dir, os.path.basename(arg)))
+                        if st is None:
+                            conn.write(b"ERR file not found\n")
+                            continue
+                        payload_bytes = str(st.st_size).encode()
+                        conn.write(f"OK {len(payload_bytes)}\n".encode())
+                        conn.write(payload_bytes)
+
+                    elif verb == 'HASH':
+                        if not arg:
+                            conn.write(b"ERR missing filename\n")
+                            continue
+                        path = os.path.join(current_dir, os.path.basename(arg))
+                        if file_stat(path) is None:
+                            conn.write(b"ERR file not found\n")
+                            continue
+                        try:
+                            payload_bytes = DIGEST_CACHE.digest(path).encode()
+                        except OSError as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+                            continue
+                        conn.write(f"OK {len(payload_bytes)}\n".encode())
+                        conn.write(payload_bytes)
+
+                    elif verb == 'PWD':
+                        # send current directory relative to base_dir
+                        try:
+                            conn.write(f"OK {len(current_pwd)}\n".encode())
+                            conn.write(current_pwd)
+                        except Exception as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+
+                    elif verb == 'CWD':
+                        # change working directory for this connection (must stay inside base_dir)
+                        if not arg:
+                            conn.write(b"ERR missing directory\n")
+                            continue
+                        try:
+                            candidate, payload_bytes, err = resolve_cwd(base_dir, current_dir, arg)
+                            if err:
+                                conn.write(err)
+                                continue
+                            current_dir, current_pwd = candidate, payload_bytes
+                            # send new PWD-like response
+                            conn.write(f"OK {len(payload_bytes)}\n".encode())
+                            conn.write(payload_bytes)
+                        except Exception as e:
+                            conn.write(f"ERR {str(e)}\n".encode())
+
+                    elif verb == 'NOOP':
+                        conn.write(b"OK\n")
+
+                    elif verb == 'STAT':
+                        payload_bytes = METRICS.render_text().encode()
+                        conn.write(f"OK {len(payload_bytes)}\n".encode())
+                        conn.write(payload_bytes)
+
+                    elif verb == 'QUIT':
+                        conn.write(b"OK bye\n")
+                        print(f"[+] {addr} closed connection")
+                        return
+
+                    else:
+                        conn.write(b"ERR unknown command\n")
+                finally:
+                    METRICS.command(verb if verb in VERBS else 'UNKNOWN', time.perf_counter() - started,
+                                    addr[0], conn.bytes_in - seen_in, conn.bytes_out - seen_out)
+                    seen_in, seen_out = conn.bytes_in, conn.bytes_out
+    except Exception as e:
+        print(f"[!] Error with {addr}: {e}")
+
+async def handle_client_async(reader, writer, base_dir):
+    """Event-loop version of handle_client speaking the same protocol."""
+    addr = writer.get_extra_info('peername')
+    print(f"[+] Connection from {addr}")
+    current_dir = os.path.abspath(base_dir)  # per-connection cwd
+    current_pwd = pwd_payload(base_dir, current_dir)  # its PWD reply, kept in step by CWD
+    pending_rest = None
+    shaper = Shaper(GLOBAL_BUCKET, CONN_RATE)
+    reader, writer = CountingReader(reader), CountingWriter(writer)
+    seen_in = seen_out = 0
+    try:
+        while True:
+            cmd_line = await reader.readline()
+            if not cmd_line.endswith(b'\n'):
+                print(f"[-] {addr} disconnected")
+                return
+            cmd = cmd_line.decode().strip()
+            if not cmd:
+                continue
+
+            parts = cmd.split(maxsplit=1)
+            verb = parts[0].upper()
+            arg = parts[1] if len(parts) > 1 else ''
+            rest, pending_rest = pending_rest, None
+
+            started = time.perf_counter()
+            try:
                 if verb == 'LS':
                     try:
-                        entries = os.listdir(current_dir)
-                        payload = '\n'.join(entries)
-                        payload_bytes = payload.encode()
-                        header = f"OK {len(payload_bytes)}\n".encode()
-                        conn.sendall(header)
-                        conn.sendall(payload_bytes)
+                        await send_listing_async(writer, current_dir, arg)
                     except Exception as e:
-                        conn.sendall(f"ERR {str(e)}\n".encode())
+                        writer.write(f"ERR {str(e)}\n".encode())
 
                 elif verb == 'GET':
+                    compress, arg = split_flag(arg, '-z')
                     if not arg:
-                        conn.sendall(b"ERR missing filename\n")
+                        writer.write(b"ERR missing filename\n")
                         continue
-                    safe_name = os.path.basename(arg)
-                    path = os.path.join(current_dir, safe_name)
-                    if not os.path.exists(path) or not os.path.isfile(path):
-                        conn.sendall(b"ERR file not found\n")
+                    path = os.path.join(current_dir, os.path.basename(arg))
+                    st = file_stat(path)
+                    if st is None:
+                        writer.write(b"ERR file not found\n")
                         continue
                     try:
-                        size = os.path.getsize(path)
-                        conn.sendall(f"OK {size}\n".encode())
+                        # a miss may read or map the whole file
+                        body = None if compress else await run_blocking(FILE_CACHE.get, path, st)
+                        if body is not None:
+                            offset, count = get_range(rest, st.st_size)
+                            digest, hasher = get_digest(path, st, rest)
+                            writer.write(get_header(count, digest))
+                            await send_body_async(writer, body, offset, count, shaper, hasher)
+                            if hasher:
+                                await run_blocking(DIGEST_CACHE.learn, path, st, hasher.hexdigest())
+                            continue
                         with open(path, 'rb') as f:
-                            while True:
-                                chunk = f.read(4096)
-                                if not chunk:
-                                    break
-                                conn.sendall(chunk)
+                            st = os.fstat(f.fileno())
+                            offset, count = get_range(rest, st.st_size)
+                            if compress:
+                                # admitting the file to COMPRESS_CACHE deflates all of it up front
+                                chunks = await run_blocking(compressed_chunks, path, f, st, offset, count)
+                                await send_chunked_async(writer, chunks, shaper)
+                            else:
+                                digest, hasher = get_digest(path, st, rest)
+                                writer.write(get_header(count, digest))
+                                if await send_file_async(writer, f, offset, count, shaper, hasher) == count and hasher:
+                                    DIGEST_CACHE.learn(path, st, hasher.hexdigest(), f)
                     except Exception as e:
-                        conn.sendall(f"ERR {str(e)}\n".encode())
+                        writer.write(f"ERR {str(e)}\n".encode())
 
                 elif verb == 'PUT':
+                    compress, arg = split_flag(arg, '-z')
                     if not arg:
-                        conn.sendall(b"ERR missing filename\n")
-                        continue
-                    safe_name = os.path.basename(arg)
-                    path = os.path.join(current_dir, safe_name)
-                    conn.sendall(b"OK ready for size\n")
-                    # read header line for SIZE
-                    header_line = b''
-                    while not header_line.endswith(b'\n'):
-                        chunk = conn.recv(1)
-                        if not chunk:
-                            conn.sendall(b"ERR connection lost\n")
-                            return
-                        header_line += chunk
+                        writer.write(b"ERR missing filename\n")
+                        continue
+                    path = os.path.join(current_dir, os.path.basename(arg))
+                    err = check_resume(path, rest)
+                    if err:
+                        writer.write(err)
+                        continue
+                    writer.write(b"OK ready for size\n")
+                    header_line = await reader.readline()
+                    if not header_line.endswith(b'\n'):
+                        return
                     header_line = header_line.decode().strip()
                     if not header_line.startswith('SIZE '):
-                        conn.sendall(b"ERR expected SIZE header\n")
+                        writer.write(b"ERR expected SIZE header\n")
                         continue
                     try:
-                        size = int(header_line.split()[1])
-                    except:
-                        conn.sendall(b"ERR bad size\n")
+                        size = parse_size_header(header_line, compress)
+                    except ValueError:
+                        writer.write(b"ERR bad size\n")
+                        continue
+                    try:
+                        offset = rest[0] if rest else 0
+                        if compress:
+                            digest = await recv_compressed_async(reader, path, offset, shaper)
+                        else:
+                            digest = await recv_to_file_async(reader, path, size, offset, shaper)
+                        if digest is None:
+                            print(f"[-] {addr} disconnected during upload")
+                            return
+                    except OSError as e:
+                        writer.write(f"ERR {str(e)}\n".encode())
+                        continue
+                    writer.write(f"OK uploaded sha256={digest}\n".encode())
+
+                elif verb == 'DPUT':
+                    if not arg:
+                        writer.write(b"ERR missing filename\n")
                         continue
-                    data = recvall(conn, size)
-                    if data is None:
-                        conn.sendall(b"ERR transfer failed\n")
+                    path = os.path.join(current_dir, os.path.basename(arg))
+                    index = block_index(base_dir)
+                    writer.write(f"OK blocks {index.block_size}\n".encode())
+                    header_line = await reader.readline()
+                    if not header_line.endswith(b'\n'):
+                        return
+                    try:
+                        size, count = parse_blocks_header(header_line.decode(), index.block_size)
+                    except ValueError as e:
+                        writer.write(f"ERR {str(e)}\n".encode())
+                        await writer.drain()
+                        return
+                    try:
+                        digests = split_digests(await reader.readexactly(count * DIGEST_SIZE))
+                    except asyncio.IncompleteReadError:
                         return
-                    with open(path, 'wb') as f:
-                        f.write(data)
-                    conn.sendall(b"OK uploaded\n")
+                    try:
+                        # hashing changed files is slow: keep it off the event loop
+                        await run_blocking(index.refresh_dir, current_dir)
+                    except OSError:
+                        pass
+                    upload = await run_blocking(prepare_delta, path, size, digests, index)
+                    missing = upload.missing()
+                    payload_bytes = ' '.join(map(str, missing)).encode()
+                    writer.write(f"OK {len(payload_bytes)}\n".encode())
+                    writer.write(payload_bytes)
+                    try:
+                        digest = await recv_delta_async(reader, upload, index, shaper)
+                        if digest is None:
+                            print(f"[-] {addr} disconnected during upload")
+                            return
+                    except OSError as e:
+                        writer.write(f"ERR {str(e)}\n".encode())
+                        continue
+                    writer.write(f"OK uploaded sha256={digest} ({len(missing)} of {count} blocks sent)\n".encode())
 
-                elif verb == 'PWD':
-                    # send current directory relative to base_dir
+                elif verb == 'REST':
                     try:
-                        base_abs = os.path.abspath(base_dir)
-                        cur_abs = os.path.abspath(current_dir)
-                        # represent as path relative to base_dir, leading '/'
-                        rel = os.path.relpath(cur_abs, base_abs)
-                        if rel == '.':
-                            rel_path = '/'
-                        else:
-                            rel_path = '/' + rel.replace('\\', '/')
-                        payload_bytes = rel_path.encode()
-                        conn.sendall(f"OK {len(payload_bytes)}\n".encode())
-                        conn.sendall(payload_bytes)
-                    except Exception as e:
-                        conn.sendall(f"ERR {str(e)}\n".encode())
+                        pending_rest = parse_rest(arg)
+                    except ValueError as e:
+                        writer.write(f"ERR {str(e)}\n".encode())
+                        continue
+                    writer.write(f"OK restarting at {pending_rest[0]}\n".encode())
+
+                elif verb == 'SIZE':
+                    if not arg:
+                        writer.write(b"ERR missing filename\n")
+                        continue
+                    st = file_stat(os.path.join(current_dir, os.path.basename(arg)))
+                    if st is None:
+                        writer.write(b"ERR file not found\n")
+                        continue
+                    payload_bytes = str(st.st_size).encode()
+                    writer.write(f"OK {len(payload_bytes)}\n".encode())
+                    writer.write(payload_bytes)
+
+                elif verb == 'HASH':
+                    if not arg:
+                        writer.write(b"ERR missing filename\n")
+                        continue
+                    path = os.path.join(current_dir, os.path.basename(arg))
+                    if file_stat(path) is None:
+                        writer.write(b"ERR file not found\n")
+                        continue
+                    try:
+                        # a miss reads the whole file: do it off the event loop
+                        digest = await run_blocking(DIGEST_CACHE.digest, path)
+                    except OSError as e:
+                        writer.write(f"ERR {str(e)}\n".encode())
+                        continue
+                    payload_bytes = digest.encode()
+                    writer.write(f"OK {len(payload_bytes)}\n".encode())
+                    writer.write(payload_bytes)
+
+                elif verb == 'PWD':
+                    writer.write(f"OK {len(current_pwd)}\n".encode())
+                    writer.write(current_pwd)
 
                 elif verb == 'CWD':
-                    # change working directory for this connection (must stay inside base_dir)
                     if not arg:
-                        conn.sendall(b"ERR missing directory\n")
+                        writer.write(b"ERR missing directory\n")
                         continue
                     try:
-                        # If arg starts with '/', treat it as relative to base_dir root
-                        if arg.startswith('/') or arg.startswith('\\'):
-                            candidate = os.path.join(base_dir, arg.lstrip('/\\'))
-                        else:
-                            candidate = os.path.join(current_dir, arg)
-                        candidate = os.path.abspath(candidate)
-                        # Verify candidate is a directory and inside base_dir
-                        if not os.path.isdir(candidate):
-                            conn.sendall(b"ERR not a directory\n")
-                            continue
-                        if not safe_within_base(base_dir, candidate):
-                            conn.sendall(b"ERR access denied\n")
-                            continue
-                        current_dir = candidate
-                        # send new PWD-like response
-                        base_abs = os.path.abspath(base_dir)
-                        cur_abs = os.path.abspath(current_dir)
-                        rel = os.path.relpath(cur_abs, base_abs)
-                        rel_path = '/' if rel == '.' else '/' + rel.replace('\\', '/')
-                        payload_bytes = rel_path.encode()
-                        conn.sendall(f"OK {len(payload_bytes)}\n".encode())
-                        conn.sendall(payload_bytes)
+                        candidate, payload_bytes, err = resolve_cwd(base_dir, current_dir, arg)
+                        if err:
+                            writer.write(err)
+                            continue
+                        current_dir, current_pwd = candidate, payload_bytes
+                        writer.write(f"OK {len(payload_bytes)}\n".encode())
+                        writer.write(payload_bytes)
                     except Exception as e:
-                        conn.sendall(f"ERR {str(e)}\n".encode())
+                        writer.write(f"ERR {str(e)}\n".encode())
+
+                elif verb == 'NOOP':
+                    writer.write(b"OK\n")
+
+                elif verb == 'STAT':
+                    payload_bytes = METRICS.render_text().encode()
+                    writer.write(f"OK {len(payload_bytes)}\n".encode())
+                    writer.write(payload_bytes)
 
                 elif verb == 'QUIT':
-                    conn.sendall(b"OK bye\n")
+                    writer.write(b"OK bye\n")
+                    await writer.drain()
                     print(f"[+] {addr} closed connection")
                     return
 
                 else:
-                    conn.sendall(b"ERR unknown command\n")
+                    writer.write(b"ERR unknown command\n")
+
+                # backpressure: let a slow peer catch up before the next command
+                await writer.drain()
+            finally:
+                METRICS.command(verb if verb in VERBS else 'UNKNOWN', time.perf_counter() - started,
+                                addr[0], reader.bytes_in - seen_in, writer.bytes_out - seen_out)
+                seen_in, seen_out = reader.bytes_in, writer.bytes_out
     except Exception as e:
         print(f"[!] Error with {addr}: {e}")
+    finally:
+        writer.close()
+
+def raise_nofile_limit():
+    # every session holds a socket; lift the soft fd limit as far as we may
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
-def start_server(port, base_dir):
+def run_client_thread(conn, addr, base_dir, limit):
+    METRICS.connection_opened()
+    try:
+        handle_client(conn, addr, base_dir)
+    finally:
+        METRICS.connection_closed()
+        limit.release()
+
+def start_server(port, base_dir, backlog=DEFAULT_BACKLOG, max_conns=0):
     base_dir = os.path.abspath(base_dir)
     pathlib.Path(base_dir).mkdir(parents=True, exist_ok=True)
     print(f"Serving directory: {base_dir} on port {port}")
+    limit = ConnectionLimit(max_conns)
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if REUSE_PORT:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         s.bind((HOST, port))
-        s.listen(5)
+        s.listen(backlog)
         print(f"[+] Listening on {HOST}:{port}")
         while True:
             conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(conn, addr, base_dir), daemon=True)
+            if not limit.acquire():
+                with conn:
+                    conn.sendall(b"ERR server busy\n")
+                continue
+            t = threading.Thread(target=run_client_thread, args=(conn, addr, base_dir, limit), daemon=True)
             t.start()
 
+async def serve_async(port, base_dir, backlog=DEFAULT_BACKLOG, max_conns=0):
+    limit = ConnectionLimit(max_conns)
+
+    async def on_connect(reader, writer):
+        if not limit.acquire():
+            writer.write(b"ERR server busy\n")
+            writer.close()
+            return
+        METRICS.connection_opened()
+        try:
+            await handle_client_async(reader, writer, base_dir)
+        finally:
+            METRICS.connection_closed()
+            limit.release()
+
+    server = await asyncio.start_server(on_connect, HOST, port, backlog=backlog, reuse_address=True,
+                                        reuse_port=REUSE_PORT)
+    print(f"[+] Listening on {HOST}:{port} (asyncio engine)")
+    async with server:
+        await server.serve_forever()
+
+def start_server_async(port, base_dir, backlog=DEFAULT_BACKLOG, max_conns=0):
+    base_dir = os.path.abspath(base_dir)
+    pathlib.Path(base_dir).mkdir(parents=True, exist_ok=True)
+    print(f"Serving directory: {base_dir} on port {port}")
+    try:
+        asyncio.run(serve_async(port, base_dir, backlog, max_conns))
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Simple FTP-like server with PWD/CWD")
     parser.add_argument('--port', '-p', type=int, default=2121, help='Port to listen on (default 2121)')
     parser.add_argument('--dir', '-d', default='server_files', help='Directory to serve (default: server_files)')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='threads: one thread per connection; asyncio: single event loop (default: threads)')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help=f'Listen backlog (default {DEFAULT_BACKLOG})')
+    parser.add_argument('--max-conns', type=int, default=0,
+                        help='Maximum concurrent sessions, 0 for unlimited (default 0)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f'Read size when copying files through userspace (default {CHUNK_SIZE})')
+    parser.add_argument('--no-sendfile', action='store_true',
+                        help='Disable zero-copy sendfile for GET and copy in --chunk-size pieces')
+    parser.add_argument('--listing-cache', type=int, default=LISTING_CACHE.max_entries,
+                        help=f'Directories whose LS output is cached, 0 to disable (default {LISTING_CACHE.max_entries})')
+    parser.add_argument('--compress-level', type=int, default=COMPRESS_LEVEL, choices=range(1, 10),
+                        metavar='1-9', help=f'zlib level for GET -z (default {COMPRESS_LEVEL})')
+    parser.add_argument('--compress-cache', type=int, default=COMPRESS_CACHE.max_bytes // (1024 * 1024),
+                        help='MiB of compressed bodies cached for GET -z, 0 to disable '
+                             f'(default {COMPRESS_CACHE.max_bytes // (1024 * 1024)})')
+    parser.add_argument('--file-cache', type=int, default=FILE_CACHE.max_bytes // (1024 * 1024),
+                        help='MiB of small hot files kept in memory for GET, 0 to disable '
+                             f'(default {FILE_CACHE.max_bytes // (1024 * 1024)})')
+    parser.add_argument('--mmap-cache', type=int, default=FILE_CACHE.max_mapped // (1024 * 1024),
+                        help='MiB of larger hot files kept mmap()ed for GET, 0 to disable; only safe if no '
+                             'other program truncates files in --dir, which would crash the server with '
+                             f'SIGBUS (default {FILE_CACHE.max_mapped // (1024 * 1024)})')
+    parser.add_argument('--rate-limit', type=parse_rate, default=0, metavar='RATE',
+                        help='Total GET/PUT bandwidth in bytes/s, e.g. 50M; shared fairly (default unlimited)')
+    parser.add_argument('--conn-rate-limit', type=parse_rate, default=0, metavar='RATE',
+                        help='GET/PUT bandwidth per connection in bytes/s, e.g. 5M (default unlimited)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port via SO_REUSEPORT; --max-conns and '
+                             '--conn-rate-limit apply per worker (default 1)')
+    parser.add_argument('--index-path', default=None,
+                        help='File the DPUT block index is saved in; must be outside --dir '
+                             '(default: .<dir>.blockindex next to --dir)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics (default off)')
     args = parser.parse_args()
-    start_server(args.port, args.dir)
+    LISTING_CACHE.max_entries = args.listing_cache
+    COMPRESS_CACHE.max_bytes = args.compress_cache * 1024 * 1024
+    COMPRESS_LEVEL = args.compress_level
+    FILE_CACHE.max_bytes = args.file_cache * 1024 * 1024
+    FILE_CACHE.max_mapped = args.mmap_cache * 1024 * 1024
+    CONN_RATE = args.conn_rate_limit
+    INDEX_PATH = os.path.abspath(args.index_path or default_index_path(args.dir))
+    if safe_within_base(args.dir, INDEX_PATH):
+        parser.error('--index-path must be outside the served directory')
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--workers needs SO_REUSEPORT, which this platform lacks')
+    if args.rate_limit:
+        # each worker gets an equal share of the total
+        share = args.rate_limit // max(1, args.workers)
+        if share < 1:
+            parser.error('--rate-limit must allow each worker at least 1 byte/s')
+        GLOBAL_BUCKET = TokenBucket(share)
+        METRICS.add_source('rate_limit', GLOBAL_BUCKET.stats)
+    CHUNK_SIZE = args.chunk_size
+    USE_SENDFILE = not args.no_sendfile
+    raise_nofile_limit()
+    serve = functools.partial(start_server_async if args.engine == 'asyncio' else start_server,
+                              args.port, args.dir, args.backlog, args.max_conns)
+    if args.workers > 1:
+        REUSE_PORT = True
+        supervisor = Supervisor(args.workers, serve, METRICS, on_exit=save_block_indexes)
+        if args.metrics_port:
+            serve_http(supervisor.totals, args.metrics_port)
+        print(f"[+] Starting {args.workers} workers")
+        exit_on_sigterm()
+        supervisor.run()
+    else:
+        if args.metrics_port:
+            serve_http(METRICS, args.metrics_port)
+        exit_on_sigterm()
+        try:
+            serve()
+        finally:
+            save_block_indexes()
@@ -0,0 +1,236 @@
+"""Server-wide counters and latency histograms for ftp_server.py.
+
+One Metrics instance is shared by every session. It is rendered as plain
+text for the STAT verb and in the Prometheus text format for the optional
+HTTP endpoint started by serve_http(). With --workers each process has its
+own instance; snapshot() and merged() let them be added up.
+"""
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+MAX_CLIENTS = 1024     # distinct client addresses tracked individually
+RECENT_TRANSFERS = 50  # GET/PUT transfers kept for the STAT report
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound below which a fraction q of observations fall."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float('inf')
+
+class Metrics:
+    """Thread-safe counters for commands, bytes, connections and transfers."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.active_connections = 0
+        self.connections_total = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.commands = {}      # verb -> Histogram of service time
+        self.transfers = {}     # verb -> [count, bytes, seconds]
+        self.clients = {}       # host -> [commands, bytes]
+        self.recent = deque(maxlen=RECENT_TRANSFERS)
+        self.sources = {}       # name -> callable returning a dict of numbers
+        self.peers = None       # snapshots of the other worker processes, if any
+        self._lock = threading.Lock()
+
+    def add_source(self, name, stats):
+        """Include stats() (a dict of numbers) in STAT and /metrics output."""
+        self.sources[name] = stats
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def command(self, verb, seconds, client, bytes_in=0, bytes_out=0):
+        """Record one command: its service time and the bytes it moved."""
+        with self._lock:
+            hist = self.commands.get(verb)
+            if hist is None:
+                hist = self.commands[verb] = Histogram()
+            hist.observe(seconds)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            entry = self.clients.get(client)
+            if entry is None and len(self.clients) < MAX_CLIENTS:
+                entry = self.clients[client] = [0, 0]
+            if entry is not None:
+                entry[0] += 1
+                entry[1] += bytes_in + bytes_out
+            moved = bytes_out if verb == 'GET' else bytes_in if verb in ('PUT', 'DPUT') else 0
+            if moved:
+                totals = self.transfers.setdefault(verb, [0, 0, 0.0])
+                totals[0] += 1
+                totals[1] += moved
+                totals[2] += seconds
+                self.recent.append((verb, client, moved, seconds))
+
+    def snapshot(self):
+        """Plain-data copy of the counters, small enough to send to another process."""
+        with self._lock:
+            snap = {
+                'started': self.started,
+                'active_connections': self.active_connections,
+                'connections_total': self.connections_total,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'commands': {verb: (h.counts[:], h.sum, h.count) for verb, h in self.commands.items()},
+                'transfers': {verb: t[:] for verb, t in self.transfers.items()},
+                'clients': {host: c[:] for host, c in self.clients.items()},
+                'recent': list(self.recent),
+            }
+        snap['sources'] = {name: stats() for name, stats in self.sources.items()}
+        return snap
+
+    @classmethod
+    def merged(cls, snapshots):
+        """A Metrics holding the sum of several snapshots, e.g. one per worker."""
+        total = cls()
+        sources = {}
+        for snap in snapshots:
+            total.started = min(total.started, snap['started'])
+            total.active_connections += snap['active_connections']
+            total.connections_total += snap['connections_total']
+            total.bytes_in += snap['bytes_in']
+            total.bytes_out += snap['bytes_out']
+            for verb, (counts, hsum, hcount) in snap['commands'].items():
+                hist = total.commands.setdefault(verb, Histogram())
+                hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+                hist.sum += hsum
+                hist.count += hcount
+            for verb, (count, nbytes, secs) in snap['transfers'].items():
+                totals = total.transfers.setdefault(verb, [0, 0, 0.0])
+                totals[0] += count
+                totals[1] += nbytes
+                totals[2] += secs
+            for host, (ncmds, nbytes) in snap['clients'].items():
+                entry = total.clients.get(host)
+                if entry is None and len(total.clients) < MAX_CLIENTS:
+                    entry = total.clients[host] = [0, 0]
+                if entry is not None:
+                    entry[0] += ncmds
+                    entry[1] += nbytes
+            total.recent.extend(snap['recent'])
+            for name, stats in snap['sources'].items():
+                summed = sources.setdefault(name, {})
+                for key, value in stats.items():
+                    summed[key] = summed.get(key, 0) + value
+        total.sources = {name: (lambda stats=stats: stats) for name, stats in sources.items()}
+        return total
+
+    def render_text(self):
+        """Human-readable report for the STAT verb."""
+        if self.peers is not None:
+            return Metrics.merged([self.snapshot()] + self.peers).render_text()
+        with self._lock:
+            lines = [
+                f"uptime {time.time() - self.started:.0f}s",
+                f"connections active={self.active_connections} total={self.connections_total}",
+                f"bytes in={self.bytes_in} out={self.bytes_out}",
+            ]
+            for verb, hist in sorted(self.commands.items()):
+                lines.append(f"cmd {verb} count={hist.count} avg={hist.sum / hist.count * 1000:.2f}ms "
+                             f"p50<={hist.quantile(0.5) * 1000:g}ms p99<={hist.quantile(0.99) * 1000:g}ms")
+            for verb, (count, nbytes, secs) in sorted(self.transfers.items()):
+                rate = nbytes / secs / 1e6 if secs else 0.0
+                lines.append(f"transfer {verb} count={count} bytes={nbytes} avg={rate:.1f}MB/s")
+            top = sorted(self.clients.items(), key=lambda kv: kv[1][1], reverse=True)[:10]
+            for host, (ncmds, nbytes) in top:
+                lines.append(f"client {host} commands={ncmds} bytes={nbytes}")
+            for verb, client, nbytes, secs in list(self.recent)[-10:]:
+                rate = nbytes / secs / 1e6 if secs else 0.0
+                lines.append(f"recent {verb} {client} {nbytes}B {secs:.3f}s {rate:.1f}MB/s")
+        for name, stats in self.sources.items():
+            lines.append(name + ' ' + ' '.join(f"{k}={v}" for k, v in stats().items()))
+        return '\n'.join(lines)
+
+    def render_prometheus(self):
+        if self.peers is not None:
+            return Metrics.merged([self.snapshot()] + self.peers).render_prometheus()
+        out = []
+        with self._lock:
+            out.append("# TYPE ftp_active_connections gauge")
+            out.append(f"ftp_active_connections {self.active_connections}")
+            out.append("# TYPE ftp_connections_total counter")
+            out.append(f"ftp_connections_total {self.connections_total}")
+            out.append("# TYPE ftp_received_bytes_total counter")
+            out.append(f"ftp_received_bytes_total {self.bytes_in}")
+            out.append("# TYPE ftp_sent_bytes_total counter")
+            out.append(f"ftp_sent_bytes_total {self.bytes_out}")
+            out.append("# TYPE ftp_command_seconds histogram")
+            for verb, hist in sorted(self.commands.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets + (float('inf'),), hist.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    out.append(f'ftp_command_seconds_bucket{{verb="{verb}",le="{le}"}} {cumulative}')
+                out.append(f'ftp_command_seconds_sum{{verb="{verb}"}} {hist.sum}')
+                out.append(f'ftp_command_seconds_count{{verb="{verb}"}} {hist.count}')
+            out.append("# TYPE ftp_transfer_bytes_total counter")
+            for verb, (_, nbytes, _) in sorted(self.transfers.items()):
+                out.append(f'ftp_transfer_bytes_total{{verb="{verb}"}} {nbytes}')
+            out.append("# TYPE ftp_transfer_seconds_total counter")
+            for verb, (_, _, secs) in sorted(self.transfers.items()):
+                out.append(f'ftp_transfer_seconds_total{{verb="{verb}"}} {secs}')
+            out.append("# TYPE ftp_client_bytes_total counter")
+            for host, (_, nbytes) in sorted(self.clients.items()):
+                out.append(f'ftp_client_bytes_total{{client="{host}"}} {nbytes}')
+        for name, stats in self.sources.items():
+            for key, value in stats().items():
+                out.append(f"ftp_{name}_{key} {value}")
+        return '\n'.join(out) + '\n'
+
+def serve_http(metrics, port, host='127.0.0.1'):
+    """Serve metrics.render_prometheus() at /metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[+] Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,303 @@
+"""Buffered socket I/O shared by ftp_server.py and ftp_client.py."""
+import asyncio
+import socket
+import zlib
+
+RECV_SIZE = 64 * 1024
+MAX_LINE = 64 * 1024
+WRITE_QUEUE_MAX = 64 * 1024  # larger writes bypass the queue
+MAX_CHUNK = 16 * 1024 * 1024  # largest chunk accepted in a chunked stream
+ZLIB_LEVEL = 6
+INFLATE_MAX = 1024 * 1024  # most bytes one decompress() step may produce
+
+# Chunked replies, for payloads whose size is not known up front:
+#   OK CHUNKED\n  then  <len>\n<len bytes>  repeated, ended by  0\n
+# A sender that fails midway ends the stream with an ERR <reason>\n line instead.
+CHUNKED = 'CHUNKED'
+
+def chunk_header(n):
+    return f"{n}\n".encode()
+
+def chunk_size(line):
+    """Parse a chunk length line, refusing sizes a peer could use to exhaust memory."""
+    n = int(line)
+    if not 0 <= n <= MAX_CHUNK:
+        raise ValueError(f"bad chunk size {n}")
+    return n
+
+def reply_digest(line):
+    """The hex digest from a 'sha256=<hex>' field of a reply line, or None."""
+    for field in line.split():
+        if field.startswith('sha256='):
+            return field[len('sha256='):]
+    return None
+
+def split_flag(arg, flag):
+    """Split a leading flag such as '-z' off a command argument: (present, rest)."""
+    parts = arg.split(maxsplit=1)
+    if parts and parts[0] == flag:
+        return True, parts[1] if len(parts) > 1 else ''
+    return False, arg
+
+def iter_chunks(sock):
+    """Yield the chunks of a chunked reply on a BufferedSocket.
+
+    Raises IOError with the server's ERR line if it aborted the stream, or
+    ConnectionError if the connection closed.
+    """
+    while True:
+        line = sock.readline()
+        if line is None:
+            raise ConnectionError("connection lost")
+        line = line.decode().strip()
+        if line.startswith('ERR'):
+            raise IOError(line)
+        n = chunk_size(line)
+        if not n:
+            return
+        data = sock.readexactly(n)
+        if data is None:
+            raise ConnectionError("connection lost")
+        yield data
+
+async def iter_chunks_async(reader):
+    """iter_chunks for an asyncio StreamReader."""
+    while True:
+        line = await reader.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionError("connection lost")
+        line = line.decode().strip()
+        if line.startswith('ERR'):
+            raise IOError(line)
+        n = chunk_size(line)
+        if not n:
+            return
+        try:
+            yield await reader.readexactly(n)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("connection lost")
+
+# Compressed transfers (GET -z / PUT -z) send one zlib stream as a chunked body.
+
+def deflate_file(f, offset, count, read_size, level=ZLIB_LEVEL, hasher=None):
+    """Yield the zlib stream of count bytes of f from offset, reading read_size at a time.
+
+    hasher, if given, is updated with the uncompressed data.
+    """
+    z = zlib.compressobj(level)
+    f.seek(offset)
+    remaining = count
+    while remaining:
+        data = f.read(min(read_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        if hasher:
+            hasher.update(data)
+        out = z.compress(data)
+        if out:
+            yield out
+    yield z.flush()
+
+class Inflater:
+    """Incremental zlib decoder whose output comes in pieces of at most max_out bytes."""
+
+    def __init__(self, max_out=INFLATE_MAX):
+        self.z = zlib.decompressobj()
+        self.max_out = max_out
+
+    def feed(self, data):
+        while data:
+            out = self.z.decompress(data, self.max_out)
+            if out:
+                yield out
+            data = self.z.unconsumed_tail
+
+    def finish(self):
+        """Return any remaining output; raises zlib.error if the stream was cut short."""
+        out = self.z.flush()
+        if not self.z.eof:
+            raise zlib.error("truncated compressed stream")
+        return out
+
+class BufferedSocket:
+    """Wraps a connected socket with a per-connection receive buffer.
+
+    Data is pulled in with one recv_into() per packet and handed out through
+    readline()/readexactly()/readinto(), so bytes that arrive ahead of time
+    (pipelined commands, the start of an upload) stay in the buffer for the
+    next read instead of being lost. Everything else is forwarded to the socket.
+
+    Small replies go through write(), which only queues them; the queue is
+    flushed before the next blocking receive or bulk send, so a batch of
+    pipelined commands is answered with one send. Nagle is turned off since
+    the buffer already coalesces small writes.
+
+    bytes_in and bytes_out count the traffic seen on the socket; queued
+    bytes count as soon as they are written, so a command is charged for its
+    whole reply even though the last of it goes out with the next flush.
+    """
+
+    def __init__(self, sock, recv_size=RECV_SIZE):
+        self.sock = sock
+        self._buf = bytearray(recv_size)
+        self._pos = 0  # first unread byte
+        self._end = 0  # one past the last buffered byte
+        self._out = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self.sock.close()
+
+    def write(self, data):
+        """Queue data to go out with the next flush."""
+        if len(self._out) + len(data) > WRITE_QUEUE_MAX:
+            self.sendall(data)
+        else:
+            self._out += data
+            self.bytes_out += len(data)
+
+    def flush(self):
+        if self._out:
+            self.sock.sendall(self._out)
+            self._out.clear()
+
+    def sendall(self, data):
+        self.flush()
+        self.sock.sendall(data)
+        self.bytes_out += len(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        self.flush()
+        sent = self.sock.sendfile(file, offset, count)
+        self.bytes_out += sent
+        return sent
+
+    def buffered(self):
+        return self._end - self._pos
+
+    def _fill(self):
+        """Receive more data into the buffer; returns False on EOF."""
+        if self._pos == self._end:
+            self._pos = self._end = 0
+        elif self._end == len(self._buf):
+            unread = self._end - self._pos
+            if self._pos:
+                # slide unread bytes to the front
+                self._buf[:unread] = self._buf[self._pos:self._end]
+            else:
+                # buffer full of a single unfinished line: grow it
+                self._buf.extend(bytes(len(self._buf)))
+            self._pos, self._end = 0, unread
+        self.flush()
+        with memoryview(self._buf) as view:
+            n = self.sock.recv_into(view[self._end:])
+        if not n:
+            return False
+        self._end += n
+        self.bytes_in += n
+        return True
+
+    def readline(self, limit=MAX_LINE):
+        """Return the next line including b'\\n', or None if the peer closed first."""
+        scanned = 0
+        while True:
+            i = self._buf.find(b'\n', self._pos + scanned, self._end)
+            if i >= 0:
+                line = bytes(self._buf[self._pos:i + 1])
+                self._pos = i + 1
+                return line
+            scanned = self._end - self._pos
+            if scanned > limit:
+                raise ValueError("line too long")
+            if not self._fill():
+                return None
+
+    def readinto(self, buf):
+        """Fill up to len(buf) bytes, draining the buffer first; returns 0 on EOF."""
+        avail = self._end - self._pos
+        if avail:
+            n = min(avail, len(buf))
+            buf[:n] = self._buf[self._pos:self._pos + n]
+            self._pos += n
+            return n
+        self.flush()
+        n = self.sock.recv_into(buf)
+        self.bytes_in += n
+        return n
+
+    def readexactly(self, n):
+        """Return exactly n bytes (bytes-like), or None if the connection closed early."""
+        if self._end - self._pos >= n:
+            data = bytes(self._buf[self._pos:self._pos + n])
+            self._pos += n
+            return data
+        data = bytearray(n)
+        got = 0
+        with memoryview(data) as view:
+            while got < n:
+                k = self.readinto(view[got:])
+                if not k:
+                    return None
+                got += k
+        return data
+
+class CountingReader:
+    """asyncio StreamReader wrapper that counts the bytes read in bytes_in."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.bytes_in = 0
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    async def readline(self):
+        line = await self.reader.readline()
+        self.bytes_in += len(line)
+        return line
+
+    async def read(self, n=-1):
+        data = await self.reader.read(n)
+        self.bytes_in += len(data)
+        return data
+
+    async def readexactly(self, n):
+        data = await self.reader.readexactly(n)
+        self.bytes_in += len(data)
+        return data
+
+class CountingWriter:
+    """asyncio StreamWriter wrapper that counts the bytes written in bytes_out."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.bytes_out = 0
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    def write(self, data):
+        self.writer.write(data)
+        self.bytes_out += len(data)
+
+    async def sendfile(self, file, offset=0, count=None):
+        loop = asyncio.get_running_loop()
+        sent = await loop.sendfile(self.writer.transport, file, offset, count)
+        self.bytes_out += sent
+        return sent
@@ -0,0 +1,89 @@
+"""Token-bucket bandwidth shaping for ftp_server.py transfers.
+
+Only GET/PUT data goes through the buckets; command replies and listings
+are never delayed, so LS/CWD stay responsive while bulk transfers are
+throttled. Transfers move SHAPE_CHUNK bytes per grant and grants are handed
+out in the order they are asked for, so concurrent transfers sharing the
+global bucket take turns chunk by chunk instead of one starving the rest.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+SHAPE_CHUNK = 64 * 1024  # bytes moved per grant while shaping
+
+def parse_rate(text):
+    """argparse type for a rate such as 500K or 10M (bytes per second), at least 1 byte/s."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().removesuffix('/S').removesuffix('B')
+    try:
+        if text and text[-1] in units:
+            rate = int(float(text[:-1]) * units[text[-1]])
+        else:
+            rate = int(text)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(f"invalid rate: {text!r}")
+    if rate < 1:
+        raise argparse.ArgumentTypeError("rate must be at least 1 byte/s")
+    return rate
+
+class TokenBucket:
+    """rate bytes per second, refilled continuously up to burst bytes.
+
+    reserve(n) takes n tokens straight away, letting the balance go negative,
+    and returns how long the caller must wait before using them. Later callers
+    queue up behind that debt, which is what makes grants first come, first
+    served.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate < 1:
+            raise ValueError(f"rate must be at least 1 byte/s, not {rate}")
+        self.rate = rate
+        self.burst = burst or max(SHAPE_CHUNK, rate // 10)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.granted = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, n):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            self.granted += n
+            delay = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            self.waited += delay
+            return delay
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'granted_bytes': self.granted, 'waited_seconds': round(self.waited, 3)}
+
+class Shaper:
+    """Throttles one connection by its own bucket and then the shared one.
+
+    A Shaper with no limits is false, so callers can keep their unshaped
+    fast path with a plain 'if shaper:'.
+    """
+
+    def __init__(self, global_bucket=None, conn_rate=0):
+        self.buckets = [b for b in (TokenBucket(conn_rate) if conn_rate else None, global_bucket) if b]
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    def wait(self, n):
+        for bucket in self.buckets:
+            delay = bucket.reserve(n)
+            if delay:
+                time.sleep(delay)
+
+    async def wait_async(self, n):
+        for bucket in self.buckets:
+            delay = bucket.reserve(n)
+            if delay:
+                await asyncio.sleep(delay)
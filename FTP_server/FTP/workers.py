@@ -0,0 +1,140 @@
+"""Pre-fork worker mode for ftp_server.py (--workers N).
+
+Each worker is a forked copy of the server that binds the port itself with
+SO_REUSEPORT, so the kernel spreads new connections across the workers and
+each one runs on its own core with its own GIL. The supervisor serves no
+clients: it restarts workers that exit and collects a Metrics snapshot from
+each one every STATS_INTERVAL. It sends each worker the snapshots of the
+others, so STAT on any connection reports the whole server, and it answers
+the --metrics-port endpoint with the same totals. A worker that is stopped,
+or loses its supervisor, runs on_exit before it goes.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import threading
+import time
+
+from metrics import Metrics
+
+STATS_INTERVAL = 1.0  # seconds between metric snapshots
+RESTART_DELAY = 1.0   # least time between two starts of the same worker slot
+
+def report_stats(conn, metrics, on_exit=None):
+    """Worker side: send our snapshot and take in the others' until the supervisor goes away."""
+    try:
+        while True:
+            conn.send(metrics.snapshot())
+            end = time.monotonic() + STATS_INTERVAL
+            while (left := end - time.monotonic()) > 0:
+                if conn.poll(left):
+                    metrics.peers = conn.recv()
+    except (EOFError, OSError):
+        # an orphaned worker would keep the port open: leave with the supervisor
+        if on_exit:
+            on_exit()
+        os._exit(1)
+
+def worker_main(conn, inherited, metrics, serve, on_exit=None):
+    # the supervisor's ends of the other workers' pipes came along with fork()
+    for other in inherited:
+        other.close()
+    metrics.peers = []
+    # the supervisor stops workers with SIGTERM: exit through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threading.Thread(target=report_stats, args=(conn, metrics, on_exit), daemon=True).start()
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if on_exit:
+            on_exit()
+
+class Supervisor:
+    """Keeps count workers running serve(), each reporting into its copy of metrics.
+
+    totals adds up the workers' snapshots, for the metrics endpoint.
+    """
+
+    def __init__(self, count, serve, metrics, on_exit=None):
+        self.count = count
+        self.serve = serve
+        self.metrics = metrics
+        self.on_exit = on_exit
+        self.ctx = multiprocessing.get_context('fork')
+        self.workers = {}   # slot -> (process, conn, started)
+        self.snapshots = {} # slot -> latest snapshot from that worker
+        self.retired = []   # last snapshots of workers that exited, so totals survive restarts
+        self.restarts = {}  # slot -> time a dead worker may be started again
+        self.totals = Metrics()
+        self.totals.peers = []
+
+    def start(self, slot):
+        parent, child = self.ctx.Pipe()
+        inherited = [conn for _, conn, _ in self.workers.values()] + [parent]
+        process = self.ctx.Process(target=worker_main,
+                                   args=(child, inherited, self.metrics, self.serve, self.on_exit), daemon=True)
+        process.start()
+        child.close()
+        self.workers[slot] = (process, parent, time.monotonic())
+        print(f"[+] Worker {slot} started (pid {process.pid})")
+
+    def reap(self, slot):
+        process, conn, started = self.workers.pop(slot)
+        process.join()
+        conn.close()
+        print(f"[!] Worker {slot} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+        last = self.snapshots.pop(slot, None)
+        if last is not None:
+            last['active_connections'] = 0
+            last['sources'] = {}  # cache sizes and the like died with it
+            self.retired = [Metrics.merged(self.retired + [last]).snapshot()]
+        self.restarts[slot] = started + RESTART_DELAY
+
+    def broadcast(self):
+        for slot, (_, conn, _) in self.workers.items():
+            others = [snap for other, snap in self.snapshots.items() if other != slot]
+            try:
+                conn.send(self.retired + others)
+            except OSError:
+                pass  # its sentinel will tell us it died
+        self.totals.peers = self.retired + list(self.snapshots.values())
+
+    def run(self):
+        for slot in range(self.count):
+            self.start(slot)
+        next_broadcast = time.monotonic() + STATS_INTERVAL
+        try:
+            while True:
+                now = time.monotonic()
+                for slot, when in list(self.restarts.items()):
+                    if when <= now:
+                        del self.restarts[slot]
+                        self.start(slot)
+                if now >= next_broadcast:
+                    self.broadcast()
+                    next_broadcast = now + STATS_INTERVAL
+                wake = min([next_broadcast] + list(self.restarts.values()))
+                sentinels = {process.sentinel: slot for slot, (process, _, _) in self.workers.items()}
+                conns = {conn: slot for slot, (_, conn, _) in self.workers.items()}
+                ready = multiprocessing.connection.wait(list(sentinels) + list(conns),
+                                                        max(0.0, wake - time.monotonic()))
+                for item in ready:
+                    if item in conns and conns[item] in self.workers:
+                        try:
+                            self.snapshots[conns[item]] = item.recv()
+                        except (EOFError, OSError):
+                            pass
+                for item in ready:
+                    if item in sentinels:
+                        self.reap(sentinels[item])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process, _, _ in self.workers.values():
+                process.terminate()
+            for process, _, _ in self.workers.values():
+                process.join()
@@ -1,13 +1,20 @@
 import socket
+import selectors
 import struct
+import argparse
 import zlib
 import random
 import time
+import os
+import sys
+# arq_common.py, shared by the three ARQ programs, sits one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arq_common import (FRAME_VERSION, HEADER_FORMAT, HEADER_SIZE, CRC_SIZE, SEQ_MODULUS, seq_diff,
+                        send_end, drain_acks, RetransmitTimers)
 
 ## ------------------ CONFIGURATION ------------------
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 12345
-BUFFER_SIZE = 2048
 TIMEOUT = 3 # seconds
 INPUT_FILE = 'input.txt'
 WINDOW_SIZE = 4 # The 'N' in Go-Back-N
@@ -15,9 +22,6 @@ WINDOW_SIZE = 4 # The 'N' in Go-Back-N
 # --- Frame Structure Constants ---
 SRC_ADDR = b'\x12\x34\x56\x78\x9A\xBC'
 DEST_ADDR = b'\xDE\xF0\x12\x34\x56\x78'
-HEADER_FORMAT = '! 6s 6s H B'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-CRC_SIZE = 4
 PAYLOAD_SIZE = 100
 
 # --- Simulation Parameters ---
@@ -29,7 +33,7 @@ def calculate_crc(data):
 
 def create_frame(seq_num, payload):
     frame_length = HEADER_SIZE + len(payload) + CRC_SIZE
-    header = struct.pack(HEADER_FORMAT, SRC_ADDR, DEST_ADDR, frame_length, seq_num % 256)
+    header = struct.pack(HEADER_FORMAT, SRC_ADDR, DEST_ADDR, frame_length, FRAME_VERSION, seq_num % SEQ_MODULUS)
     crc = calculate_crc(header + payload)
     return header + payload + struct.pack('!I', crc)
 
@@ -37,92 +41,114 @@ def run_sender(sock):
     base = 0
     next_seq_num = 0
     unacknowledged_frames = {}
-    timer_start_time = None
+    timers = RetransmitTimers(TIMEOUT) # Go-Back-N runs a single timer, for the base frame
     
     ack_buffer = b''
-    ack_frame_size = 4 # b'ACK' + 1 byte for seq_num
+    ack_frame_size = 7 # b'ACK' + 4 bytes for seq_num
 
     f = open(INPUT_FILE, 'rb')
     file_done = False
+    transfer_start = time.time()
+
+    # The socket stays blocking for sendall(); the selector tells us when
+    # ACKs are waiting, so the loop sleeps instead of polling
+    sock.settimeout(None)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
 
     while not file_done or unacknowledged_frames:
-        # --- 1. Check for a timeout (highest priority) ---
-        if timer_start_time and (time.time() - timer_start_time > TIMEOUT):
-            print(f"!! TIMEOUT for base frame {base}. Retransmitting window.")
-            for seq_num in sorted(unacknowledged_frames.keys()):
-                sock.sendall(unacknowledged_frames[seq_num])
-                print(f"-> Resent Frame {seq_num}")
+        # --- 1. Send new frames while the window has space ---
+        while next_seq_num < base + WINDOW_SIZE and not file_done:
+            payload = f.read(PAYLOAD_SIZE)
+            if not payload:
+                file_done = True
+                break
+            frame_to_send = create_frame(next_seq_num, payload)
+            unacknowledged_frames[next_seq_num] = frame_to_send
             
-            # Restart the timer after retransmitting
-            timer_start_time = time.time()
+            if random.random() < PACKET_LOSS_PROB:
+                print(f"-> [SIM] Frame {next_seq_num} is LOST.")
+            else:
+                sock.sendall(frame_to_send)
+                print(f"-> Sent Frame {next_seq_num}")
+
+            # Start timer if this is the first frame in the window
+            if base == next_seq_num:
+                timers.start(base)
+            
+            next_seq_num += 1
+
+        if not unacknowledged_frames:
+            continue
 
-        # --- 2. Try to receive an ACK ---
+        # --- 2. Sleep until an ACK arrives or the base frame times out ---
+        wait = max(0.0, timers.next_deadline() - time.time())
         try:
-            sock.settimeout(0.0) # Set to non-blocking
-            new_data = sock.recv(BUFFER_SIZE)
-            ack_buffer += new_data
-        except BlockingIOError:
-            # This is the normal case when no data is available
-            pass
-        except Exception as e:
+            if sel.select(wait):
+                ack_buffer += drain_acks(sock, sel)
+        except OSError as e:
             print(f"An error occurred while receiving ACKs: {e}")
             break
-        
-        # --- Process one ACK from the buffer if available ---
-        if len(ack_buffer) >= ack_frame_size:
+
+        # --- Process every complete ACK in the buffer ---
+        while len(ack_buffer) >= ack_frame_size:
             ack_data = ack_buffer[:ack_frame_size]
             if ack_data.startswith(b'ACK'):
-                ack_seq_num = ack_data[3]
+                # Frames are counted without wrapping here; map the 32-bit ACK
+                # back to the count nearest the window base
+                ack_seq_num = base + seq_diff(int.from_bytes(ack_data[3:7], 'big'), base % SEQ_MODULUS)
                 print(f"<- Received Cumulative ACK {ack_seq_num}. OK.")
 
                 if ack_seq_num >= base:
                     # Remove acknowledged frames
-                    acked_keys = [k for k in unacknowledged_frames if k <= ack_seq_num]
-                    for k in acked_keys:
-                        del unacknowledged_frames[k]
+                    for k in range(base, ack_seq_num + 1):
+                        unacknowledged_frames.pop(k, None)
                     
+                    timers.cancel(base)
                     base = ack_seq_num + 1
                     print(f"   Window base slides to {base}")
                     
                     # Restart timer for the new base frame
                     if unacknowledged_frames:
-                        timer_start_time = time.time()
-                    else:
-                        timer_start_time = None # Stop timer
+                        timers.start(base)
             
             # Trim the processed ACK from the buffer
             ack_buffer = ack_buffer[ack_frame_size:]
 
-        # --- 3. Send one new frame if the window has space ---
-        if next_seq_num < base + WINDOW_SIZE and not file_done:
-            payload = f.read(PAYLOAD_SIZE)
-            if not payload:
-                file_done = True
-            else:
-                frame_to_send = create_frame(next_seq_num, payload)
-                unacknowledged_frames[next_seq_num] = frame_to_send
-                
-                if random.random() < PACKET_LOSS_PROB:
-                    print(f"-> [SIM] Frame {next_seq_num} is LOST.")
-                else:
-                    sock.sendall(frame_to_send)
-                    print(f"-> Sent Frame {next_seq_num}")
-
-                # Start timer if this is the first frame in the window
-                if base == next_seq_num:
-                    timer_start_time = time.time()
-                
-                next_seq_num += 1
+        # --- 3. Retransmit the whole window if the base frame timed out ---
+        if timers.expired():
+            print(f"!! TIMEOUT for base frame {base}. Retransmitting window.")
+            for seq_num in sorted(unacknowledged_frames.keys()):
+                sock.sendall(unacknowledged_frames[seq_num])
+                print(f"-> Resent Frame {seq_num}")
+            
+            # Restart the timer after retransmitting
+            timers.start(base)
     
+    sel.close()
+    elapsed = time.time() - transfer_start
+    print(f"\nDelivered {f.tell()} bytes in {elapsed:.2f}s (goodput {f.tell() / elapsed:.0f} B/s)")
     f.close()
     print("\nEnd of file reached and all ACKs received. Sending termination signal.")
-    sock.sendall(b'END')
+    send_end(sock, TIMEOUT)
 
 if __name__ == "__main__":
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    parser = argparse.ArgumentParser(description="Go-Back-N sender")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp',
+                        help='udp sends one datagram per frame, so only the ARQ protocol provides reliability (default tcp)')
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE,
+                        help='window size N (default %(default)s, frames in flight; up to SEQ_MODULUS // 2)')
+    args = parser.parse_args()
+    if not 1 <= args.window <= SEQ_MODULUS // 2:
+        parser.error(f"--window must be between 1 and {SEQ_MODULUS // 2}")
+    WINDOW_SIZE = args.window
+
+    # A connected UDP socket supports the same sendall()/recv() calls as TCP
+    sock_type = socket.SOCK_DGRAM if args.transport == 'udp' else socket.SOCK_STREAM
+    client_socket = socket.socket(socket.AF_INET, sock_type)
     try:
         client_socket.connect((SERVER_HOST, SERVER_PORT))
-        print(f"✅ Go-Back-N Client connected to server at {SERVER_HOST}:{SERVER_PORT}")
+        print(f"✅ Go-Back-N Client connected to server at {SERVER_HOST}:{SERVER_PORT} ({args.transport.upper()})")
         print(f"   Window Size (N) = {WINDOW_SIZE}\n")
         run_sender(client_socket)
     except ConnectionRefusedError:
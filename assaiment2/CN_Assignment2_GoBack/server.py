@@ -1,35 +1,47 @@
 import socket
 import struct
+import argparse
 import zlib
 import random
+import os
+import sys
+# arq_common.py, shared by the three ARQ programs, sits one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arq_common import (FRAME_VERSION, HEADER_FORMAT, HEADER_SIZE, CRC_SIZE, SEQ_MODULUS,
+                        recv_frames, accept_datagram, recv_datagrams)
 
 ## ------------------ CONFIGURATION ------------------
 HOST = '127.0.0.1'
 PORT = 12345
-BUFFER_SIZE = 2048
+UDP_RCVBUF = 4 * 1024 * 1024 # room for a whole large window of datagrams (capped by net.core.rmem_max)
 OUTPUT_FILE = 'output.txt'
-
-# --- Frame Structure Constants ---
-HEADER_FORMAT = '! 6s 6s H B'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-CRC_SIZE = 4
 ## ----------------------------------------------------
 
 def calculate_crc(data):
     return zlib.crc32(data)
 
 def create_ack(seq_num):
-    # ACK frame format: b'ACK' + sequence number (1 byte)
-    return b'ACK' + seq_num.to_bytes(1, 'big')
+    # ACK frame format: b'ACK' + sequence number (4 bytes)
+    return b'ACK' + seq_num.to_bytes(4, 'big')
 
-def run_receiver():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(1)
-    print(f"✅ Go-Back-N Server is listening on {HOST}:{PORT}")
+def run_receiver(transport='tcp'):
+    if transport == 'udp':
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        server_socket.bind((HOST, PORT))
+    else:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind((HOST, PORT))
+        server_socket.listen(1)
+    print(f"✅ Go-Back-N Server is listening on {HOST}:{PORT} ({transport.upper()})")
     print(f"   Received data will be saved to '{OUTPUT_FILE}'")
 
-    client_socket, client_address = server_socket.accept()
+    if transport == 'udp':
+        client_socket, client_address, first = accept_datagram(server_socket)
+        frames = recv_datagrams(client_socket, first)
+    else:
+        client_socket, client_address = server_socket.accept()
+        frames = recv_frames(client_socket)
     print(f"\nConnection established from {client_address}")
     
     expected_seq_num = 0
@@ -37,8 +49,11 @@ def run_receiver():
     try:
         with open(OUTPUT_FILE, 'wb') as f:
             while True:
-                frame = client_socket.recv(BUFFER_SIZE)
+                frame = next(frames, None)
                 if not frame or frame == b'END':
+                    if frame == b'END' and transport == 'udp':
+                        # Echo the END so the sender can stop repeating it
+                        client_socket.sendall(b'END')
                     print("\nTermination signal received. Shutting down.")
                     break
 
@@ -56,7 +71,10 @@ def run_receiver():
                     print("❌ CRC mismatch! Frame is corrupt. Discarding.")
                     continue
 
-                _, _, _, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                _, _, _, version, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                if version != FRAME_VERSION:
+                    print(f"❌ Unsupported frame version {version}. Discarding.")
+                    continue
                 
                 print(f"<- Received Frame {received_seq_num}")
                 
@@ -70,15 +88,15 @@ def run_receiver():
                     print(f"-> Sent ACK {expected_seq_num}")
 
                     # Increment to the next expected frame
-                    expected_seq_num = (expected_seq_num + 1) % 256
+                    expected_seq_num = (expected_seq_num + 1) % SEQ_MODULUS
                 else:
                     # If frame is out of order, discard it
                     print(f"   ⚠️ Frame {received_seq_num} is out-of-order (expected {expected_seq_num}). Discarding.")
-                    # Resend ACK for the last correctly received frame to help the sender
-                    if expected_seq_num > 0:
-                        last_ack = create_ack(expected_seq_num - 1)
-                        client_socket.sendall(last_ack)
-                        print(f"-> Resent ACK for last successful frame: {expected_seq_num - 1}")
+                    # Resend ACK for the last correctly received frame to help the sender.
+                    # Before frame 0 this is SEQ_MODULUS - 1, which the sender ignores.
+                    last_seq_num = (expected_seq_num - 1) % SEQ_MODULUS
+                    client_socket.sendall(create_ack(last_seq_num))
+                    print(f"-> Resent ACK for last successful frame: {last_seq_num}")
     
     finally:
         client_socket.close()
@@ -86,4 +104,8 @@ def run_receiver():
         print("Connection closed.")
 
 if __name__ == "__main__":
-    run_receiver()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Go-Back-N receiver")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp',
+                        help='udp sends one datagram per frame, so only the ARQ protocol provides reliability (default tcp)')
+    args = parser.parse_args()
+    run_receiver(args.transport)
\ No newline at end of file
@@ -1,36 +1,48 @@
 import socket
 import struct
+import argparse
 import zlib
 import random
+import os
+import sys
+# arq_common.py, shared by the three ARQ programs, sits one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arq_common import (FRAME_VERSION, HEADER_FORMAT, HEADER_SIZE, CRC_SIZE, SEQ_MODULUS, seq_diff,
+                        recv_frames, accept_datagram, recv_datagrams)
 
 ## ------------------ CONFIGURATION ------------------
 HOST = '127.0.0.1'
 PORT = 12345
-BUFFER_SIZE = 2048
+UDP_RCVBUF = 4 * 1024 * 1024 # room for a whole large window of datagrams (capped by net.core.rmem_max)
 OUTPUT_FILE = 'output_sr.txt'
 WINDOW_SIZE = 4 # The 'N' in Selective Repeat
-
-# --- Frame Structure Constants ---
-HEADER_FORMAT = '! 6s 6s H B'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-CRC_SIZE = 4
 ## ----------------------------------------------------
 
 def calculate_crc(data):
     return zlib.crc32(data)
 
 def create_ack(seq_num):
-    return b'ACK' + seq_num.to_bytes(1, 'big')
+    return b'ACK' + seq_num.to_bytes(4, 'big')
 
-def run_receiver():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(1)
-    print(f"✅ Selective Repeat Server is listening on {HOST}:{PORT}")
+def run_receiver(transport='tcp'):
+    if transport == 'udp':
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        server_socket.bind((HOST, PORT))
+    else:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind((HOST, PORT))
+        server_socket.listen(1)
+    print(f"✅ Selective Repeat Server is listening on {HOST}:{PORT} ({transport.upper()})")
     print(f"   Window Size (N) = {WINDOW_SIZE}")
     print(f"   Received data will be saved to '{OUTPUT_FILE}'")
 
-    client_socket, client_address = server_socket.accept()
+    if transport == 'udp':
+        client_socket, client_address, first = accept_datagram(server_socket)
+        frames = recv_datagrams(client_socket, first)
+    else:
+        client_socket, client_address = server_socket.accept()
+        frames = recv_frames(client_socket)
     print(f"\nConnection established from {client_address}")
     
     expected_seq_num = 0
@@ -39,8 +51,11 @@ def run_receiver():
     try:
         with open(OUTPUT_FILE, 'wb') as f:
             while True:
-                frame = client_socket.recv(BUFFER_SIZE)
+                frame = next(frames, None)
                 if not frame or frame == b'END':
+                    if frame == b'END' and transport == 'udp':
+                        # Echo the END so the sender can stop repeating it
+                        client_socket.sendall(b'END')
                     print("\nTermination signal received. Shutting down.")
                     break
 
@@ -58,13 +73,17 @@ def run_receiver():
                     print("❌ CRC mismatch! Frame is corrupt. Discarding.")
                     continue
 
-                _, _, _, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                _, _, _, version, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                if version != FRAME_VERSION:
+                    print(f"❌ Unsupported frame version {version}. Discarding.")
+                    continue
                 
                 print(f"<- Received Frame {received_seq_num}")
                 
                 # --- Selective Repeat Logic ---
                 # Check if the frame is within the receiver's window
-                if expected_seq_num <= received_seq_num < expected_seq_num + WINDOW_SIZE:
+                offset = seq_diff(received_seq_num, expected_seq_num)
+                if 0 <= offset < WINDOW_SIZE:
                     # Always send an ACK for a valid frame within the window
                     ack_to_send = create_ack(received_seq_num)
                     client_socket.sendall(ack_to_send)
@@ -74,14 +93,14 @@ def run_receiver():
                     if received_seq_num == expected_seq_num:
                         print(f"   ✅ Frame {expected_seq_num} is in-order. Accepting.")
                         f.write(payload)
-                        expected_seq_num += 1
+                        expected_seq_num = (expected_seq_num + 1) % SEQ_MODULUS
                         
                         # Check buffer for next frames that can now be delivered
                         while expected_seq_num in receive_buffer:
                             print(f"   ✅ Delivering buffered Frame {expected_seq_num}.")
                             buffered_payload = receive_buffer.pop(expected_seq_num)
                             f.write(buffered_payload)
-                            expected_seq_num += 1
+                            expected_seq_num = (expected_seq_num + 1) % SEQ_MODULUS
                         print(f"   Receiver window base slides to {expected_seq_num}")
 
                     # If it's an out-of-order frame, buffer it
@@ -91,7 +110,7 @@ def run_receiver():
                             receive_buffer[received_seq_num] = payload
                 
                 # If frame is a duplicate of an already delivered frame, just ACK it again
-                elif received_seq_num < expected_seq_num:
+                elif offset < 0:
                     ack_to_send = create_ack(received_seq_num)
                     client_socket.sendall(ack_to_send)
                     print(f"-> Resent ACK for duplicate Frame {received_seq_num}")
@@ -102,4 +121,13 @@ def run_receiver():
         print("Connection closed.")
 
 if __name__ == "__main__":
-    run_receiver()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Selective Repeat receiver")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp',
+                        help='udp sends one datagram per frame, so only the ARQ protocol provides reliability (default tcp)')
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE,
+                        help='receiver window N, must match the sender (default %(default)s, frames in flight; up to SEQ_MODULUS // 2)')
+    args = parser.parse_args()
+    if not 1 <= args.window <= SEQ_MODULUS // 2:
+        parser.error(f"--window must be between 1 and {SEQ_MODULUS // 2}")
+    WINDOW_SIZE = args.window
+    run_receiver(args.transport)
\ No newline at end of file
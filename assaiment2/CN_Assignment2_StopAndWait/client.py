@@ -3,20 +3,22 @@ import struct
 import zlib
 import random
 import time
+import os
+import sys
+# arq_common.py, shared by the three ARQ programs, sits one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arq_common import (BUFFER_SIZE, FRAME_VERSION, HEADER_FORMAT, HEADER_SIZE, CRC_SIZE,
+                        SEQ_MODULUS, RetransmitTimers)
 
 ## ------------------ CONFIGURATION ------------------
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 12345
-BUFFER_SIZE = 2048
 TIMEOUT = 2
 INPUT_FILE = 'input.txt'
 
 # --- Frame Structure Constants (as per PDF) ---
 SRC_ADDR = b'\x12\x34\x56\x78\x9A\xBC'
 DEST_ADDR = b'\xDE\xF0\x12\x34\x56\x78'
-HEADER_FORMAT = '! 6s 6s H B'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-CRC_SIZE = 4
 PAYLOAD_SIZE = 50
 
 # --- Simulation Parameters ---
@@ -29,9 +31,9 @@ def calculate_crc(data):
 def create_frame(seq_num, payload):
     frame_length = HEADER_SIZE + len(payload) + CRC_SIZE
     
-    # The sequence number is packed as a single unsigned byte ('B').
-    # Using modulo (%) ensures it wraps around from 255 back to 0, preventing errors.
-    header = struct.pack(HEADER_FORMAT, SRC_ADDR, DEST_ADDR, frame_length, seq_num % 256)
+    # The sequence number is packed as an unsigned 32-bit int ('I').
+    # Using modulo (%) ensures it wraps around to 0 after 2**32 - 1, preventing errors.
+    header = struct.pack(HEADER_FORMAT, SRC_ADDR, DEST_ADDR, frame_length, FRAME_VERSION, seq_num % SEQ_MODULUS)
     
     crc = calculate_crc(header + payload)
     return header + payload + struct.pack('!I', crc)
@@ -46,6 +48,7 @@ def run_sender():
         return
 
     seq_num = 0
+    timers = RetransmitTimers(TIMEOUT)
     
     try:
         with open(INPUT_FILE, 'rb') as f:
@@ -60,25 +63,33 @@ def run_sender():
                 while not ack_received:
                     if random.random() < PACKET_LOSS_PROB:
                         print(f"-> [SIM] Frame {seq_num} is LOST.")
-                        time.sleep(TIMEOUT)
                     else:
                         client_socket.sendall(frame_to_send)
                         print(f"-> Sent Frame {seq_num}")
+                    timers.start(seq_num)
                     
-                    client_socket.settimeout(TIMEOUT)
-                    
-                    try:
-                        ack_data = client_socket.recv(BUFFER_SIZE)
-                        if ack_data and ack_data.startswith(b'ACK'):
-                            ack_seq_num = int.from_bytes(ack_data[3:], 'big')
-                            if ack_seq_num == seq_num:
+                    # Wait for the ACK until the frame's timer runs out; a wrong
+                    # ACK does not restart the wait
+                    while not ack_received and not timers.expired():
+                        client_socket.settimeout(max(0.01, timers.next_deadline() - time.time()))
+                        try:
+                            ack_data = client_socket.recv(BUFFER_SIZE)
+                        except socket.timeout:
+                            continue
+                        if not ack_data:
+                            print("❌ Server closed the connection.")
+                            return
+                        if ack_data.startswith(b'ACK'):
+                            ack_seq_num = int.from_bytes(ack_data[3:7], 'big')
+                            if ack_seq_num == seq_num % SEQ_MODULUS:
                                 print(f"<- Received ACK {ack_seq_num}. OK.")
+                                timers.cancel(seq_num)
                                 ack_received = True
                             else:
-                                print(f"<- Received wrong ACK {ack_seq_num}. Expecting {seq_num}. Ignoring.")
+                                print(f"<- Received wrong ACK {ack_seq_num}. Expecting {seq_num % SEQ_MODULUS}. Ignoring.")
                         else:
                              print("<- Received invalid ACK. Ignoring.")
-                    except socket.timeout:
+                    if not ack_received:
                         print(f"!! TIMEOUT! No ACK for frame {seq_num}. Retransmitting...")
     
                 # Increment the sequence number for the next frame
@@ -2,18 +2,18 @@ import socket
 import struct
 import zlib
 import random
+import os
+import sys
+# arq_common.py, shared by the three ARQ programs, sits one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arq_common import (FRAME_VERSION, HEADER_FORMAT, HEADER_SIZE, CRC_SIZE, SEQ_MODULUS, seq_diff,
+                        recv_frames)
 
 ## ------------------ CONFIGURATION ------------------
 HOST = '127.0.0.1'
 PORT = 12345
-BUFFER_SIZE = 2048
 OUTPUT_FILE = 'output.txt'
 
-# --- Frame Structure Constants (as per PDF) ---
-HEADER_FORMAT = '! 6s 6s H B'
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
-CRC_SIZE = 4
-
 # --- Simulation Parameters ---
 ACK_LOSS_PROB = 0.2
 ## ----------------------------------------------------
@@ -22,7 +22,7 @@ def calculate_crc(data):
     return zlib.crc32(data)
 
 def create_ack(seq_num):
-    return b'ACK' + seq_num.to_bytes(1, 'big')
+    return b'ACK' + seq_num.to_bytes(4, 'big')
 
 def run_receiver():
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -38,8 +38,9 @@ def run_receiver():
     
     try:
         with open(OUTPUT_FILE, 'wb') as f:
+            frames = recv_frames(client_socket)
             while True:
-                frame = client_socket.recv(BUFFER_SIZE)
+                frame = next(frames, None)
                 if not frame or frame == b'END':
                     print("\nTermination signal received. Shutting down.")
                     break
@@ -57,7 +58,10 @@ def run_receiver():
                     print("❌ CRC mismatch! Frame is corrupt. Discarding.")
                     continue
 
-                _, _, _, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                _, _, _, version, received_seq_num = struct.unpack(HEADER_FORMAT, header_data)
+                if version != FRAME_VERSION:
+                    print(f"❌ Unsupported frame version {version}. Discarding.")
+                    continue
                 
                 print(f"<- Received Frame {received_seq_num}")
                 
@@ -76,11 +80,11 @@ def run_receiver():
                         print(f"-> Sent ACK {expected_seq_num}")
 
                     # Increment the sequence number
-                    expected_seq_num += 1
+                    expected_seq_num = (expected_seq_num + 1) % SEQ_MODULUS
                 else:
                     print(f"   Frame {received_seq_num} is not expected (expected {expected_seq_num}).")
                     # Handle re-sending the ACK for the last successful frame
-                    if received_seq_num < expected_seq_num:
+                    if seq_diff(received_seq_num, expected_seq_num) < 0:
                         last_ack_num = received_seq_num
                         ack_to_send = create_ack(last_ack_num)
                         print(f"-> Detected duplicate. Resending ACK {last_ack_num}.")
@@ -0,0 +1,169 @@
+"""Frame format and helpers shared by the Stop-and-Wait, Go-Back-N and Selective Repeat programs.
+
+Each program adds this directory to sys.path and imports from here, so the
+frame layout, the sequence number arithmetic and the timer/stream helpers
+are written once.
+"""
+import socket
+import struct
+import heapq
+import time
+
+BUFFER_SIZE = 2048
+END_RETRIES = 5 # times the END signal is repeated over UDP
+
+# --- Frame Structure Constants ---
+# Version 2 header: the version byte sits before a 32-bit sequence number
+FRAME_VERSION = 2
+HEADER_FORMAT = '! 6s 6s H B I'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CRC_SIZE = 4
+SEQ_MODULUS = 2 ** 32 # Sequence numbers wrap around after this
+
+def seq_diff(a, b):
+    """Signed distance from b to a in the wrapping sequence space (serial number arithmetic).
+
+    Correct as long as the two numbers are less than SEQ_MODULUS // 2 apart:
+    the --window limit guarantees it for Go-Back-N and Selective Repeat, and
+    Stop-and-Wait has at most one frame outstanding.
+    """
+    return (a - b + SEQ_MODULUS // 2) % SEQ_MODULUS - SEQ_MODULUS // 2
+
+## ------------------ Receiver side ------------------
+
+def recv_frames(sock):
+    """Yield each complete frame from the TCP stream, or b'END' for the termination signal.
+
+    TCP keeps no message boundaries: one recv() may hold several frames that
+    the sender pipelined, or only part of one. Bytes are buffered across
+    recv() calls and cut into frames using the frame_length header field.
+    """
+    buffer = bytearray()
+    while True:
+        while True:
+            if buffer[:3] == b'END':
+                yield b'END'
+                return
+            if len(buffer) < HEADER_SIZE:
+                break
+            _, _, frame_length, _, _ = struct.unpack(HEADER_FORMAT, buffer[:HEADER_SIZE])
+            if frame_length < HEADER_SIZE + CRC_SIZE:
+                # The length itself is garbage, so there is no way to find the next frame
+                print("❌ Received a malformed frame header. Discarding buffered data.")
+                buffer.clear()
+                break
+            if len(buffer) < frame_length:
+                break
+            frame = bytes(buffer[:frame_length])
+            del buffer[:frame_length]
+            yield frame
+
+        data = sock.recv(BUFFER_SIZE)
+        if not data:
+            return
+        buffer += data
+
+def accept_datagram(sock):
+    """Wait for the first datagram and connect the UDP socket to its sender.
+
+    A connected UDP socket can then be used like the TCP one: sendall() goes
+    to the client and recv() only returns the client's datagrams.
+    """
+    first, client_address = sock.recvfrom(BUFFER_SIZE)
+    sock.connect(client_address)
+    return sock, client_address, first
+
+def recv_datagrams(sock, first):
+    """Yield frames from a UDP socket, where every datagram is exactly one frame."""
+    frame = first
+    while True:
+        yield frame
+        if frame == b'END':
+            return
+        frame = sock.recv(BUFFER_SIZE)
+
+## ------------------ Sender side ------------------
+
+def send_end(sock, timeout):
+    """Send the termination signal; over UDP repeat it until the receiver echoes it."""
+    if sock.type != socket.SOCK_DGRAM:
+        sock.sendall(b'END')
+        return
+    sock.settimeout(timeout)
+    for _ in range(END_RETRIES):
+        sock.sendall(b'END')
+        try:
+            while sock.recv(BUFFER_SIZE) != b'END':
+                pass # Late ACKs still in flight
+            return
+        except socket.timeout:
+            print("!! TIMEOUT waiting for the END echo. Resending END.")
+        except ConnectionRefusedError:
+            return # The receiver already closed, so it got the END
+    print("❌ Receiver never confirmed END.")
+
+def drain_acks(sock, sel):
+    """Return every ACK byte already waiting on the socket, without blocking.
+
+    Raises ConnectionError if the receiver has gone away.
+    """
+    data = b''
+    while sel.select(0):
+        chunk = sock.recv(BUFFER_SIZE)
+        if not chunk:
+            raise ConnectionError("receiver closed the connection")
+        data += chunk
+    return data
+
+class RetransmitTimers:
+    """Per-frame retransmission timers kept in a min-heap of deadlines.
+
+    start() arms (or re-arms) a frame's timer in O(log n). cancel() only
+    forgets the frame's live deadline in O(1); its heap entry becomes stale
+    and is thrown away when it reaches the top (lazy cancellation).
+    expired() pops every timer that has run out, earliest first.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._heap = []  # (deadline, seq_num), possibly stale
+        self._live = {}  # seq_num -> deadline of its current timer
+
+    def __contains__(self, seq_num):
+        return seq_num in self._live
+
+    def __len__(self):
+        return len(self._live)
+
+    def start(self, seq_num):
+        deadline = time.time() + self.timeout
+        self._live[seq_num] = deadline
+        heapq.heappush(self._heap, (deadline, seq_num))
+
+    def cancel(self, seq_num):
+        self._live.pop(seq_num, None)
+        # Rebuild once stale entries dominate, so the heap stays O(live timers)
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._heap = [(d, s) for s, d in self._live.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap and self._live.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """Time at which the earliest live timer expires, or None if none is running."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def expired(self):
+        """Stop and return the sequence numbers whose timers have run out."""
+        now = time.time()
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, seq_num = heapq.heappop(self._heap)
+            del self._live[seq_num]
+            due.append(seq_num)
+            self._drop_stale()
+        return due